@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import got
+
+# ------------------------------------
+# Fake Discord objects, just enough for the handlers in got.py
+# ------------------------------------
+class FakeRole:
+    def __init__(self, name):
+        self.name = name
+
+class FakeUser:
+    def __init__(self, name, user_id):
+        self.name = name
+        self.id = user_id
+        self.roles = [FakeRole("BOT-Control")]
+
+class FakeChannel:
+    def __init__(self, channel_id, latency):
+        self.id = channel_id
+        self.latency = latency
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.latency)
+
+class FakeResponse:
+    def __init__(self, latency):
+        self.latency = latency
+        self.done = False
+
+    async def send_message(self, content=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.done = True
+
+    async def defer(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.done = True
+
+    async def edit_message(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.done = True
+
+    async def send_modal(self, modal):
+        self.done = True
+
+    def is_done(self):
+        return self.done
+
+class FakeFollowup:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.latency)
+
+class FakeClient:
+    def __init__(self, latency):
+        self.latency = latency
+        self.channels = {}
+
+    def get_channel(self, channel_id):
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeChannel(channel_id, self.latency)
+        return self.channels[channel_id]
+
+    async def fetch_channel(self, channel_id):
+        return self.get_channel(channel_id)
+
+class FakeInteraction:
+    def __init__(self, user, client, latency, guild_id=got.GUILD_ID):
+        self.user = user
+        self.client = client
+        self.guild_id = guild_id
+        self.response = FakeResponse(latency)
+        self.followup = FakeFollowup(latency)
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+
+# ------------------------------------
+# Synthetic campaign
+# ------------------------------------
+def build_world(n_areas, n_players, workdir):
+    # a campaign in workdir with a roster and map of the requested size, loaded through got's own loaders
+    rng = random.Random(n_areas * 7919 + n_players)
+    directory = os.path.join(workdir, f"{n_areas}-{n_players}")
+    os.makedirs(directory)
+    campaign = got.Campaign(got.GUILD_ID, directory)
+    with open(campaign.registry.filename, "w") as f:
+        for i in range(n_players):
+            name = "ADMIN" if i == 0 else f"player{i}"
+            f.write(f"{name},user{i},{1000 + i},{10000 if i == 0 else 3},{5000 + i}\n")
+    campaign.registry.load()
+    info = got.Storage(players=campaign.registry.entries)
+    for i in range(n_areas):
+        growth = [rng.randint(0, 3) for _ in got.RESOURCES]
+        info.areas[f"Area{i}"] = got.Area(f"Area{i}", *growth, rng.randint(5, 20), int(i % 5 == 0), rng.randint(0, 2), int(i % 3 == 0))
+    players = list(info.players.values())
+    for i, area in enumerate(info.areas.values()):
+        owner = players[i % len(players)]
+        owner.add_area(area)
+        area.owner = owner
+    for p in players:
+        p.resources = dict.fromkeys(got.RESOURCES, 10**9)
+        p.totals["population"] += 10**9     # never the limiting factor in a benchmark
+        p.totals["city"] += 1
+    campaign.attach(info)
+    return campaign
+
+def install(campaign):
+    # route the fake interactions' guild to the synthetic campaign, every write stays inside its directory
+    got.campaigns.add(campaign)
+
+# ------------------------------------
+# Scenarios, each returns one coroutine per call
+# ------------------------------------
+def scenarios(info, client, latency):
+    names = [name for name in info.players if name != "ADMIN"]
+    areas = list(info.areas.values())
+    admin = FakeUser("user0", 5000)
+
+    def interaction(user=admin):
+        return FakeInteraction(user, client, latency)
+
+    async def trade(i):
+        await got.trade.callback(interaction(), names[i % len(names)], "food", "wood")
+
+    async def armybuy(i):
+        view = got.ArmyBuyView(names[i % len(names)])
+        view.num_selected, view.troop_selected = 3, "archers"
+        await view.confirm_button.callback(interaction())
+
+    async def weekly_update(i):
+        await got.weekly_update.callback(interaction())
+
+    async def raven_broadcast(i):
+        info.players["ADMIN"].ravens_left = info.players["ADMIN"].raven_limit
+        modal = got.RavenModal("Everyone", "ADMIN", None)
+        modal.message._value = f"Benchmark raven {i}"
+        await modal.on_submit(interaction())
+
+    async def redistrict(i):
+        area_from, area_to = areas[i % len(areas)], areas[(i + 1) % len(areas)]
+        if area_from.growth["food"] <= 0:
+            area_from, area_to = area_to, area_from
+        view = got.RedistrictView(area_from, area_to)
+        view.resource = "food"
+        await view.confirm_button.callback(interaction())
+
+    async def dashboard(i):
+        # open it and flip through every page, as a DM checking the game would
+        view = got.DashboardView(list(info.players))
+        await got.dashboard.callback(interaction())
+        for _ in range(view.pages - 1):
+            await view.next_button.callback(interaction())
+
+    return {"trade": trade, "armybuy": armybuy, "weekly_update": weekly_update,
+            "raven_broadcast": raven_broadcast, "redistrict": redistrict, "dashboard": dashboard}
+
+async def timed(scenario, i):
+    start = time.perf_counter()
+    await scenario(i)
+    return time.perf_counter() - start
+
+async def run_scenario(scenario, iterations, concurrency):
+    # `concurrency` interactions in flight at once, like that many DMs clicking together
+    latencies = []
+    start = time.perf_counter()
+    for batch in range(0, iterations, concurrency):
+        latencies += await asyncio.gather(*(timed(scenario, i) for i in range(batch, min(batch + concurrency, iterations))))
+    return time.perf_counter() - start, latencies
+
+def persistence(info, workdir):
+    # what the background writer pays per save, whole campaign and a single player
+    results = {}
+    for backend in (got.JsonBackend(os.path.join(workdir, "values.csv")), got.SqliteBackend(os.path.join(workdir, "values.db"))):
+        writer = got.StorageWriter(info, backend, 0)
+        for label, names in (("all", None), ("one", [next(iter(info.players))])):
+            latencies = []
+            for _ in range(5):
+                writer.mark_dirty(names)
+                start = time.perf_counter()
+                backend.save(writer.snapshot())
+                latencies.append(time.perf_counter() - start)
+            results[f"save {type(backend).__name__[:-7].lower()} {label}"] = (sum(latencies), latencies)
+    return results
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def report(n_areas, n_players, results):
+    print(f"\n{n_areas} areas, {n_players} players")
+    print(f"{'command':<22}{'calls':>7}{'ops/s':>11}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, (elapsed, latencies) in results.items():
+        print(f"{name:<22}{len(latencies):>7}{len(latencies) / elapsed:>11.0f}"
+              f"{1000 * statistics.median(latencies):>10.2f}{1000 * percentile(latencies, 0.99):>10.2f}")
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_areas in args.areas:
+            for n_players in args.players:
+                campaign = build_world(n_areas, n_players, workdir)
+                install(campaign)
+                info = campaign.info
+                client = FakeClient(args.latency / 1000)
+                got.dispatcher.client = client
+                results = {}
+                for name, scenario in scenarios(info, client, args.latency / 1000).items():
+                    if args.only and name not in args.only:
+                        continue
+                    iterations = args.iterations if name != "weekly_update" else max(1, args.iterations // 10)
+                    with contextlib.redirect_stdout(io.StringIO()):     # handlers log, e.g. every raven
+                        results[name] = await run_scenario(scenario, iterations, args.concurrency)
+                if not args.only or "persistence" in args.only:
+                    results.update(persistence(info, workdir))
+                report(n_areas, n_players, results)
+        got.campaigns.close()
+
+def numbers(text):
+    return [int(n) for n in text.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of got.py command handlers")
+    parser.add_argument("--areas", type=numbers, default=[59, 1000, 10000], help="comma separated map sizes")
+    parser.add_argument("--players", type=numbers, default=[11, 100], help="comma separated roster sizes")
+    parser.add_argument("--iterations", type=int, default=500, help="calls per command")
+    parser.add_argument("--concurrency", type=int, default=1, help="interactions in flight at once, e.g. 200")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated Discord API latency in ms")
+    parser.add_argument("--only", nargs="*", help="commands to run, plus 'persistence'")
+    asyncio.run(main(parser.parse_args()))
@@ -4,159 +4,1912 @@ from discord import app_commands, ui, Interaction
 import os
 import json
 import math
+import numpy as np
+import asyncio
+import tempfile
+import sqlite3
+import hashlib
+import pickle
+import struct
+import time
+import threading
+import signal
+import uuid
+import datetime
+import functools
+import bisect
+from collections import deque, Counter, OrderedDict
+import difflib
+import re
+import io
+import csv
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+from collections.abc import MutableMapping
+
+def pack(slots: dict, values=()):
+    # a fixed-index array from a dict, missing keys are 0; floats (the DM's infinite supply) need a float array
+    # whole floats (2.0 read back from a save) are stored as ints
+    values = dict(values)
+    row = [values.get(key, 0) for key in slots]
+    row = [int(v) if isinstance(v, float) and v.is_integer() else v for v in row]
+    return array("q" if all(isinstance(v, int) for v in row) else "d", row)
+
+class Vector(MutableMapping):
+    # a dict-like view over a fixed-index array, reads and writes go straight to the array;
+    # `slots` maps key -> position and is shared by every array of the same kind
+    __slots__ = ("slots", "data")
+
+    def __init__(self, slots: dict, data: array):
+        self.slots = slots
+        self.data = data
+
+    def __getitem__(self, key):
+        return self.data[self.slots[key]]
+
+    def __setitem__(self, key, value):
+        self.data[self.slots[key]] = value
+
+    def __delitem__(self, key):
+        raise TypeError("vector keys are fixed")
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def copy(self):
+        return dict(zip(self.slots, self.data))
+
+    def __repr__(self):
+        return repr(self.copy())
+
+RESOURCES = ("food", "wood", "stone", "steel", "gold")
+RESOURCE_SLOTS = {resource: i for i, resource in enumerate(RESOURCES)}
 
 class Area:
-    def __init__(self, name, food, wood, stone, steel, gold, population, port, fort, city):
+    __slots__ = ("name", "_growth", "population", "port", "fort", "city", "neighbours", "owner")
+
+    def __init__(self, name, food, wood, stone, steel, gold, population, port, fort, city, neighbours=()):
         self.name = name
-        self.growth = {"food": food, "wood": wood, "stone": stone, "steel": steel, "gold": gold}
+        self.growth = zip(RESOURCES, (food, wood, stone, steel, gold))
         self.population = population
         self.port = port
         self.fort = fort
         self.city = city
+        self.neighbours = tuple(neighbours)     # names of areas one land move away, sea links come from ports
         self.owner = None
     
-    def weekly_addition(self, resources):
-        for resource in self.growth:    # only cumulative resources
-            resources[resource] += self.growth[resource]
-        return resources
-    
+    @property
+    def growth(self):
+        return Vector(RESOURCE_SLOTS, self._growth)
+
+    @growth.setter
+    def growth(self, values):
+        self._growth = pack(RESOURCE_SLOTS, values)
+
     def resources(self):
         resources = self.growth.copy()
         resources.update({"population": self.population, "port": self.port, "fort": self.fort, "city": self.city})
         return resources
 
+    def amount(self, resource):
+        # one entry of resources() without building the dict
+        return self.growth[resource] if resource in RESOURCE_SLOTS else getattr(self, resource)
+
+    def adjust(self, resource, amount):
+        if resource in RESOURCE_SLOTS:
+            self.growth[resource] += amount
+        else:
+            setattr(self, resource, getattr(self, resource) + amount)
+            if self.owner is not None:
+                self.owner.totals[resource] += amount     # keep the owner's aggregates in step
+
     def __str__(self):
         return self.name
     
     def __repr__(self):
         return self.name
 
+# every troop type: label, purchase cost, weekly upkeep, how much population each unit takes,
+# the chance it lands a blow each round of a battle and whether it fights on land or at sea
+UNITS = {
+    "men_at_arms":   {"label": "Men at Arms",    "cost": {"food": 1},                            "upkeep": {"food": 1}, "population": 1, "strength": 0.30, "naval": False},
+    "cavalry":       {"label": "Cavalry",        "cost": {"food": 2, "steel": 1},                "upkeep": {"food": 2}, "population": 1, "strength": 0.50, "naval": False},
+    "archers":       {"label": "Archers",        "cost": {"food": 1, "wood": 1},                 "upkeep": {"food": 1}, "population": 1, "strength": 0.40, "naval": False},
+    "siege_weapons": {"label": "Siege Weapons",  "cost": {"wood": 10, "stone": 10, "steel": 5},  "upkeep": {},          "population": 1, "strength": 0.20, "naval": False},
+    "fleet":         {"label": "Fleet of Ships", "cost": {"wood": 20, "steel": 10},              "upkeep": {},          "population": 1, "strength": 0.40, "naval": True},
+    "war_galley":    {"label": "War Galley",     "cost": {"wood": 10, "steel": 10},              "upkeep": {},          "population": 1, "strength": 0.60, "naval": True},
+}
+TROOPS = tuple(UNITS)
+TROOP_SLOTS = {troop: i for i, troop in enumerate(TROOPS)}
+
+def format_cost(cost: dict):
+    return ", ".join(f"{amount} {resource}" for resource, amount in cost.items()) or "nothing"
+AREA_TOTALS = ("port", "fort", "city", "population")
+TOTAL_SLOTS = {key: i for i, key in enumerate(AREA_TOTALS)}
+CHECK_AGGREGATES = os.getenv("CHECK_AGGREGATES", "0") == "1"
+
 class Player:
+    __slots__ = ("name", "_resources", "_army", "_totals", "seals", "areas", "username", "channel", "raven_limit", "ravens_left", "troops")
+
     def __init__(self, name: str, username: str, channel: discord.TextChannel, raven_limit: int):
         self.name = name
-        self.resources = {"food": 0, "wood": 0, "stone": 0, "steel": 0, "gold": 0}
-        self.army = {"men_at_arms": 0, "cavalry": 0, "archers": 0, "siege_weapons": 0, "fleet": 0, "war_galley": 0}
+        self.resources = {}
+        self.army = {}
         self.seals = set()
         self.areas = set()
         self.username = username
         self.channel = channel
         self.raven_limit = raven_limit
         self.ravens_left = raven_limit
+        # running totals over owned areas and population used by troops,
+        # kept up to date by add_area/remove_area/Area.adjust/change_army
+        self.totals = {}
+        self.troops = 0
     
     def __str__(self):
         return self.name
 
+    # resources, army and totals are fixed-index arrays behind dict-like views,
+    # assigning a dict (e.g. loaded from disk) copies it in
+    @property
+    def resources(self):
+        return Vector(RESOURCE_SLOTS, self._resources)
+
+    @resources.setter
+    def resources(self, values):
+        self._resources = pack(RESOURCE_SLOTS, values)
+
+    @property
+    def army(self):
+        return Vector(TROOP_SLOTS, self._army)
+
+    @army.setter
+    def army(self, values):
+        self._army = pack(TROOP_SLOTS, values)
+
+    @property
+    def totals(self):
+        return Vector(TOTAL_SLOTS, self._totals)
+
+    @totals.setter
+    def totals(self, values):
+        self._totals = pack(TOTAL_SLOTS, values)
+
     def weekly_addition(self):
-        self.ravens_left = self.raven_limit     # refill ravens
-        for area in self.areas:
-            self.resources = area.weekly_addition(self.resources)
-        self.resources["food"] -= self.army["men_at_arms"] + 2*self.army["cavalry"] + self.army["archers"]
+        self.ravens_left = self.raven_limit     # refill ravens, resources are handled by the economy
+
+    def add_area(self, area: Area):
+        if area in self.areas:
+            return
+        self.areas.add(area)
+        for key in AREA_TOTALS:
+            self.totals[key] += getattr(area, key)
+
+    def remove_area(self, area: Area):
+        if area not in self.areas:
+            return
+        self.areas.remove(area)
+        for key in AREA_TOTALS:
+            self.totals[key] -= getattr(area, key)
+
+    def change_army(self, troop: str, amount: int):
+        # never drops below zero, returns how many were actually added or removed
+        amount = max(amount, -self.army.get(troop, 0))
+        self.army[troop] = self.army.get(troop, 0) + amount
+        self.troops += amount * UNITS[troop]["population"]
+        return amount
+
+    def set_army(self, army: dict):
+        self.army = army
+        self.troops = self.recompute()[1]
+
+    def recompute(self):
+        totals = {key: sum(getattr(area, key) for area in self.areas) for key in AREA_TOTALS}
+        return totals, sum(amount * UNITS[troop]["population"] for troop, amount in self.army.items())
+
+    def check_aggregates(self):
+        # compare the cache against a full recompute, report and repair any drift
+        totals, troops = self.recompute()
+        if totals != self.totals or troops != self.troops:
+            print(f"⚠️ Aggregates for {self.name} drifted: cached {self.totals}/{self.troops}, actual {totals}/{troops}")
+            self.totals, self.troops = totals, troops
+            return False
+        return True
+
+    def total(self, key):
+        if CHECK_AGGREGATES:
+            self.check_aggregates()
+        return self.totals[key]
     
     def port(self):
-        ports = 0
-        for area in self.areas:
-            ports += area.port
-        return ports
+        return self.total("port")
     def fort(self):
-        forts = 0
-        for area in self.areas:
-            forts += area.fort
-        return forts
+        return self.total("fort")
     def population(self):
-        population = 0
-        for area in self.areas:
-            population += area.population
-        for troop in self.army:
-            population -= self.army[troop]
-        return max(0,population)
+        return max(0, self.total("population") - self.troops)
     def city(self):
-        cities = 0
-        for area in self.areas:
-            cities += area.city
-        return cities
+        return self.total("city")
 
     
 class Storage:
     def __init__(self, players):
-        self.players = {name: Player(name, username, channel, raven_limit) for (name, username, channel, raven_limit) in players}
+        self.players = {name: Player(name, username, channel, raven_limit) for (name, username, channel, raven_limit, *_) in players}
         self.areas = {}
 
-    def to_dict(self):
+    def to_dict(self, names=None):
+        players = self.players.values() if names is None else [self.players[n] for n in names if n in self.players]
         return {
             player.name: {
-                "resources": player.resources,
+                "resources": dict(player.resources),    # copies, the writer serialises them off the loop
                 "areas": [area.name for area in player.areas],
-                "army": player.army,
+                "army": dict(player.army),
                 "seals": list(player.seals),
-            } for player in self.players.values()
+                "ravens_left": player.ravens_left,
+            } for player in players
         }
     
     def from_dict(self, data):
-        players = {}
+        # saved state onto the roster's players, a roster player with nothing saved yet keeps their defaults
         for player_name, info in data.items():
+            if player_name not in self.players:
+                continue        # no longer in the roster
             p = self.players[player_name]
 
             p.resources = info.get("resources", {})
-            p.army = info.get("army", {})
+            p.set_army(info.get("army", {}))
             area_names = info.get("areas", [])
             p.seals = set(info.get("seals", []))
+            p.ravens_left = info.get("ravens_left", p.raven_limit)
             for area_name in area_names:
                 if area_name in self.areas:
-                    p.areas.add(self.areas[area_name])
+                    p.add_area(self.areas[area_name])
                     self.areas[area_name].owner = p
-            players[player_name] = p
-        self.players = players
 
 
+def freeze(info: Storage):
+    # the campaign as plain tuples and raw array bytes, far quicker to pickle than the linked objects
+    areas = [(a.name, a._growth.typecode, a._growth.tobytes(), a.population, a.port, a.fort, a.city, a.neighbours,
+              a.owner.name if a.owner else None) for a in info.areas.values()]
+    players = [(p.name, p.username, p.channel, p.raven_limit, p._resources.typecode, p._resources.tobytes(),
+                p._army.tobytes(), p._totals.tobytes(), p.troops, p.ravens_left, tuple(p.seals)) for p in info.players.values()]
+    return pickle.dumps((players, areas), protocol=pickle.HIGHEST_PROTOCOL)
+
+def thaw(payload: bytes):
+    # freeze() back into a Storage of linked players and areas, cached totals kept as they were
+    players, areas = pickle.loads(payload)
+    state = Storage(players=[])
+    for name, username, channel, raven_limit, typecode, resources, army, totals, troops, ravens_left, seals in players:
+        p = state.players[name] = Player(name, username, channel, raven_limit)
+        p._resources, p._army, p._totals = array(typecode, resources), array("q", army), array("q", totals)
+        p.troops, p.ravens_left, p.seals = troops, ravens_left, set(seals)
+    for name, typecode, growth, population, port, fort, city, neighbours, owner in areas:
+        area = state.areas[name] = Area(name, *array(typecode, growth), population, port, fort, city, neighbours)
+        if owner in state.players:
+            area.owner = state.players[owner]
+            area.owner.areas.add(area)
+    return state
+
+OFFLOAD_WORKERS = int(os.getenv("OFFLOAD_WORKERS", str(min(4, os.cpu_count() or 1))))
+OFFLOAD_TIMEOUT = float(os.getenv("OFFLOAD_TIMEOUT", "30"))
+
+class OffloadError(Exception):
+    pass
+
+WORKER_STATES = 2       # campaigns each worker keeps thawed, the least recently used is dropped after that
+worker_state = OrderedDict()    # in each worker: campaign directory -> (version, Storage), thawed once per version
+worker_lock = threading.Lock()  # with no worker processes, jobs share this process's cache from several threads
+
+def run_job(func, key, version, payload, args):
+    if payload is None:
+        return func(*args)
+    with worker_lock:
+        cached = worker_state.get(key)
+        if cached is not None and cached[0] == version:
+            worker_state.move_to_end(key)
+    if cached is None or cached[0] != version:
+        cached = (version, thaw(payload))
+        with worker_lock:
+            worker_state[key] = cached
+            worker_state.move_to_end(key)
+            while len(worker_state) > WORKER_STATES:
+                worker_state.popitem(last=False)
+    return func(cached[1], *args)
+
+class Offload:
+    # registered pure functions run in a pool of worker processes, optionally over a frozen copy of a
+    # campaign, so heavy analysis never stalls the gateway heartbeat or anyone else's interaction;
+    # with no workers configured they run in a thread instead
+    def __init__(self, workers: int, timeout: float):
+        self.workers = workers
+        self.timeout = timeout
+        self.functions = set()
+        self.pool = None
+        self.snapshots = {}     # campaign directory -> (version, frozen state), refrozen only after a change
+        self.jobs = {}          # user id -> {cancel event: function name}
+
+    def register(self, func):
+        self.functions.add(func)
+        return func
+
+    def snapshot(self, campaign):
+        cached = self.snapshots.get(campaign.directory)
+        if cached is None or cached[0] != campaign.version:
+            cached = self.snapshots[campaign.directory] = (campaign.version, freeze(campaign.info))
+        return cached
+
+    def forget(self, campaign):
+        self.snapshots.pop(campaign.directory, None)
+        with worker_lock:   # only filled here when jobs run in threads, worker processes drop theirs by LRU
+            worker_state.pop(campaign.directory, None)
+
+    async def run(self, interaction, func, *args, campaign=None):
+        # func(*args), or func(state, *args) with a campaign; the interaction should already be deferred
+        if func not in self.functions:
+            raise RuntimeError(f"{func.__name__} is not registered for offloading")
+        job = (campaign.directory, *self.snapshot(campaign)) if campaign is not None else (None, None, None)
+        if self.workers > 0:
+            if self.pool is None:   # spawned, forking a process with live threads and an event loop isn't safe
+                self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            future = asyncio.wrap_future(self.pool.submit(run_job, func, *job, args))
+        else:
+            future = asyncio.ensure_future(asyncio.to_thread(run_job, func, *job, args))
+        cancelled = asyncio.Event()
+        jobs = self.jobs.setdefault(interaction.user.id, {})
+        jobs[cancelled] = func.__name__
+        waiter = asyncio.ensure_future(cancelled.wait())
+        done = set()
+        try:
+            done, _ = await asyncio.wait({future, waiter}, timeout=self.timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            del jobs[cancelled]
+            if future not in done:
+                future.cancel()     # drops it if it hasn't started, a job already running finishes and is ignored
+        if future in done:
+            return future.result()
+        raise OffloadError("Cancelled." if cancelled.is_set() else f"Gave up after {self.timeout:.0f}s.")
+
+    def cancel(self, user_id: int):
+        # stop waiting on every job this user has running, returns their names
+        jobs = self.jobs.get(user_id, {})
+        for cancelled in jobs:
+            cancelled.set()
+        return list(jobs.values())
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+offload = Offload(OFFLOAD_WORKERS, OFFLOAD_TIMEOUT)
+
+def stack(rows, width: int):
+    # fixed-index arrays as the rows of one matrix, straight from their raw bytes when they are all ints
+    if all(row.typecode == "q" for row in rows):
+        return np.frombuffer(b"".join(rows), dtype=np.int64).reshape(-1, width)
+    return np.array([row.tolist() for row in rows], dtype=np.float64).reshape(-1, width)
+
+class Economy:
+    # area growth, ownership and army upkeep as arrays, so a week for every player is one vectorised step
+    def __init__(self):
+        self.upkeep = np.array([[UNITS[troop]["upkeep"].get(resource, 0) for resource in RESOURCES] for troop in TROOPS], dtype=np.int64)
+        self.names = None
+        self.net = None
+
+    def invalidate(self):
+        self.net = None
+
+    def build(self, info: Storage):
+        # rebuilt lazily after any mutation, resources are always read fresh since trades change them constantly
+        self.names = list(info.players)
+        index = {name: i for i, name in enumerate(self.names)}
+        areas = list(info.areas.values())
+        growth = stack([area.growth.data for area in areas], len(RESOURCES))
+        owner = np.array([index.get(area.owner.name, -1) if area.owner else -1 for area in areas], dtype=np.int64)
+        owned = owner >= 0
+        income = np.zeros((len(self.names), len(RESOURCES)), dtype=np.int64)
+        np.add.at(income, owner[owned], growth[owned])
+        army = stack([info.players[name].army.data for name in self.names], len(TROOPS))
+        self.net = income - army @ self.upkeep
+
+    def resources(self, info: Storage):
+        return stack([info.players[name].resources.data for name in self.names], len(RESOURCES))
+
+    def tick(self, info: Storage, weeks: int = 1):
+        if self.net is None:
+            self.build(info)
+        totals = self.resources(info) + weeks * self.net
+        for name, row in zip(self.names, totals.tolist()):
+            info.players[name].resources = zip(RESOURCES, row)
+
+    def forecast(self, info: Storage, player_name: str, weeks: int):
+        # one row per week from now (week 0) to `weeks` ahead
+        if self.net is None:
+            self.build(info)
+        i = self.names.index(player_name)
+        return self.resources(info)[i] + np.arange(weeks + 1, dtype=np.int64)[:, None] * self.net[i]
+
+class RenderCache:
+    # each player's formatted resources, areas and army plus their dashboard embed, redrawn only
+    # once store_info has bumped that player's version (or everyone's) since they were last drawn
+    def __init__(self):
+        self.epoch = 0          # bumped by changes that touch every player
+        self.versions = {}
+        self.cache = {}         # player name -> (version, sections)
+
+    def bump(self, names=None):
+        if names is None:
+            self.epoch += 1
+            self.cache.clear()
+        else:
+            for name in names:
+                self.versions[name] = self.versions.get(name, 0) + 1
+
+    def version(self, name: str):
+        return self.epoch, self.versions.get(name, 0)
+
+    def render(self, player: Player):
+        version = self.version(player.name)
+        cached = self.cache.get(player.name)
+        if cached is None or cached[0] != version:
+            cached = self.cache[player.name] = (version, self.draw(player))
+        return cached[1]
+
+    @staticmethod
+    def draw(player: Player):
+        res = player.resources.copy()
+        res.update({"port": player.port(), "fort": player.fort(), "population": player.population(), "city": player.city()})
+        resources = "\n".join(f"**{k.title()}**: {v}" for k, v in res.items())
+        areas = ", ".join(a.name for a in player.areas) or "None"
+        army = "\n".join(f"**{k.title()}**: {v}" for k, v in player.army.items())
+        embed = discord.Embed(title=player.name.title())
+        embed.add_field(name="📦 Resources", value=resources)
+        embed.add_field(name="⚔️ Army", value=army)
+        embed.add_field(name=f"🏰 Areas ({len(player.areas)})", value=areas if len(areas) <= 1024 else areas[:1020].rsplit(", ", 1)[0] + ", …", inline=False)
+        return {"resources": resources, "areas": areas, "army": army, "embed": embed}
+
+BATTLE_SIMULATIONS = int(os.getenv("BATTLE_SIMULATIONS", "20000"))
+BATTLE_ROUNDS = int(os.getenv("BATTLE_ROUNDS", "50"))
+FORT_BONUS = float(os.getenv("FORT_BONUS", "0.5"))         # each fort level scales the defenders' blows up and the attackers' down by this
+SIEGE_BREACH = float(os.getenv("SIEGE_BREACH", "0.5"))     # fort levels each siege weapon cancels
+
+@offload.register
+def simulate_battle(attacker: dict, defender: dict, fort: int = 0, naval: bool = False,
+                    simulations: int = BATTLE_SIMULATIONS, rng=None):
+    # every simulation at once: rows are simulations, columns troop types. Each round every unit lands a blow
+    # with its strength as the chance, and each blow kills one of the other side, spread across its troop types
+    rng = rng or np.random.default_rng()
+    fighting = np.array([UNITS[troop]["naval"] == naval for troop in TROOPS])
+    strength = np.array([UNITS[troop]["strength"] for troop in TROOPS]) * fighting
+    start_att = np.array([attacker.get(troop, 0) for troop in TROOPS], dtype=np.int64) * fighting
+    start_def = np.array([defender.get(troop, 0) for troop in TROOPS], dtype=np.int64) * fighting
+    walls = 1 + FORT_BONUS * max(0.0, fort - SIEGE_BREACH * start_att[TROOPS.index("siege_weapons")])
+    # only troop types someone actually brought are simulated
+    att_cols, def_cols = np.flatnonzero(start_att), np.flatnonzero(start_def)
+    p_att = np.minimum(strength[att_cols] / walls, 0.95)
+    p_def = np.minimum(strength[def_cols] * walls, 0.95)
+    att = np.repeat(start_att[None, att_cols], simulations, axis=0)
+    dfn = np.repeat(start_def[None, def_cols], simulations, axis=0)
+    rounds = np.zeros(simulations, dtype=np.int64)
+    for _ in range(BATTLE_ROUNDS):
+        att_total, def_total = att.sum(axis=1), dfn.sum(axis=1)
+        fighting_on = (att_total > 0) & (def_total > 0)
+        if not fighting_on.any():
+            break
+        rounds += fighting_on
+        att_hits = rng.binomial(att, p_att).sum(axis=1)
+        def_hits = rng.binomial(dfn, p_def).sum(axis=1)
+        # a side with no one left takes no more blows, np.divide leaves those rows at zero
+        att_dead = np.divide(def_hits, att_total, out=np.zeros(simulations), where=att_total > 0).clip(0, 1)
+        def_dead = np.divide(att_hits, def_total, out=np.zeros(simulations), where=def_total > 0).clip(0, 1)
+        att -= rng.binomial(att, att_dead[:, None])
+        dfn -= rng.binomial(dfn, def_dead[:, None])
+    won = (att.sum(axis=1) > 0) & (dfn.sum(axis=1) == 0)    # defenders still standing hold the field
+    return {
+        "attacker_wins": float(won.mean()),
+        "attacker_losses": {TROOPS[c]: float(start_att[c] - mean) for c, mean in zip(att_cols, att.mean(axis=0).tolist())},
+        "defender_losses": {TROOPS[c]: float(start_def[c] - mean) for c, mean in zip(def_cols, dfn.mean(axis=0).tolist())},
+        "rounds": float(rounds.mean()),
+        "walls": float(walls),
+    }
+
+GUILD_ID = 1423782088494157896     # the original campaign, its files live next to got.py
 DEFAULT_RAVEN = 1432351712160518224
-players=[
-    ("ADMIN", "smazzz_", 1432351712160518224, 10000),
-    ("flo", "ftomlin", 1432352198045597777, 3),
-    ("rico", "thiccboiseal", 1432352106819616873, 3), 
-    ("toby", "tob33", 1432351866183749703, 4), 
-    ("tom", "tom7061", 1432351681030389790, 3), 
-    ("connor", "c.sissle", 1432352340790345828, 3),
-    ("callum", "callum300524", 1438155998677434460, 3), 
-    ("dom", "?", 0, 3), 
-    ("ethan", "vocalpaladin507", 1433834384288645210, 3), 
-    ("olive", "shortolive", 1433834460046163988, 3),
-    ("lucas", "quacamole.", 1433834445705707520, 3)
-]
-
-info = Storage(players=players)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-with open(os.path.join(BASE_DIR,"resources.csv")) as file:
-    for line in file.readlines():
-        name,food,wood,stone,steel,gold,population,port,fort,city = line.split(",")
-        info.areas[name] = Area(name,int(food),int(wood),int(stone),int(steel),int(gold),int(population),int(port),int(fort),int(city))
-
-def store_info(info: Storage):
-    filename = os.path.join(BASE_DIR,"values.csv")
-    with open(filename, "w") as f:
-        json.dump(info.to_dict(), f, indent=2)
-
-def retrieve_info(info: Storage):
-    filename = os.path.join(BASE_DIR,"values.csv")
-    if not os.path.exists(filename):
-        store_info(info)
-    with open(filename, "r") as f:
-        data = json.load(f)
+CAMPAIGNS_DIR = os.path.join(BASE_DIR,"campaigns")
+
+class PlayerRegistry:
+    # the roster from players.csv (name,username,channel,raven_limit,user_id), indexed for O(1) lookups
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.entries = []
+        self.by_name = {}
+        self.by_username = {}
+        self.by_id = {}
+
+    def load(self):
+        # parse everything before swapping, so a bad file leaves the old roster in place
+        entries = []
+        with open(self.filename) as file:
+            for number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    name,username,channel,raven_limit,user_id = (field.strip() for field in line.split(","))
+                    entries.append((name, username, int(channel), int(raven_limit), int(user_id) if user_id else None))
+                except ValueError:
+                    raise ValueError(f"{os.path.basename(self.filename)} line {number} is not name,username,channel,raven_limit,user_id")
+        self.entries = entries
+        self.by_name = {entry[0]: entry for entry in entries}
+        self.by_username = {entry[1]: entry[0] for entry in entries}
+        self.by_id = {entry[4]: entry[0] for entry in entries if entry[4] is not None}
+
+    def lookup(self, user):
+        # Discord IDs survive username changes, so they win when the roster has one
+        return self.by_id.get(user.id) or self.by_username.get(user.name)
+
+def load_map(campaign):
+    # name,food,wood,stone,steel,gold,population,port,fort,city[,neighbour;neighbour;...]
+    with open(campaign.map_file) as file:
+        for line in file.readlines():
+            name,food,wood,stone,steel,gold,population,port,fort,city,*neighbours = line.strip().split(",")
+            neighbours = [n for n in neighbours[0].split(";") if n] if neighbours else []
+            campaign.info.areas[name] = Area(name,int(food),int(wood),int(stone),int(steel),int(gold),int(population),int(port),int(fort),int(city),neighbours)
+    campaign.graph.invalidate()
+
+ROUTE_CACHE = 256      # BFS rows kept per campaign, each is 4 bytes per area
+
+class MapLayout:
+    # one map's areas as numbered nodes, replaced whole when ports change so a search already
+    # running in a thread keeps a consistent view
+    def __init__(self, areas: dict):
+        self.names = list(areas)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        land = [set() for _ in self.names]
+        for name, area in areas.items():
+            for neighbour in area.neighbours:
+                if neighbour in self.index and neighbour != name:
+                    a, b = self.index[name], self.index[neighbour]
+                    land[a].add(b)
+                    land[b].add(a)
+        self.land = [sorted(links) for links in land]
+        self.is_port = np.array([area.port > 0 for area in areas.values()], dtype=bool)
+        self.ports = np.flatnonzero(self.is_port).tolist()
+        self.rows = OrderedDict()   # source -> moves to every area, -1 where there is no way through, least recently used first
+
+    def search(self, source: int):
+        # breadth first search where every port is one move from every other, the ports are expanded
+        # together the first time any of them is reached so the search stays O(areas + land links)
+        dist = [-1] * len(self.names)
+        dist[source] = 0
+        frontier = [source]
+        sailed = False
+        while frontier:
+            following = []
+            for a in frontier:
+                step = dist[a] + 1
+                for b in self.land[a]:
+                    if dist[b] < 0:
+                        dist[b] = step
+                        following.append(b)
+                if not sailed and self.is_port[a]:
+                    sailed = True
+                    for b in self.ports:
+                        if dist[b] < 0:
+                            dist[b] = step
+                            following.append(b)
+            frontier = following
+        return np.array(dist, dtype=np.int32)
+
+class MapGraph:
+    # land links from the map plus a sea lane between every pair of ports; moves from an area are
+    # searched once and kept until a change of ports (or a new map) throws the layout away.
+    # route, reachable and ready are meant to run in a thread, a large map takes a while
+    def __init__(self, areas):
+        self.areas = areas      # callable returning the current name -> Area dict
+        self.layout = None
+        self.lock = threading.Lock()
+        self.supply = {}        # player name -> {area name: root}, a union-find over their areas
+
+    def invalidate(self):
+        self.layout = None
+        self.supply.clear()
+
+    def ready(self):
+        with self.lock:
+            if self.layout is None:
+                self.layout = MapLayout(self.areas())
+            return self.layout
+
+    def distances(self, layout: MapLayout, source: int):
+        with self.lock:
+            row = layout.rows.get(source)
+            if row is not None:
+                layout.rows.move_to_end(source)
+                return row
+        row = layout.search(source)
+        with self.lock:
+            layout.rows[source] = row
+            while len(layout.rows) > ROUTE_CACHE:
+                layout.rows.popitem(last=False)
+        return row
+
+    def route(self, area_from: str, area_to: str):
+        # [(area name, came by sea), ...] from area_from to area_to, None when it can't be reached;
+        # walked back from area_to through areas one move nearer, by land where there is a choice
+        layout = self.ready()
+        a, b = layout.index[area_from], layout.index[area_to]
+        dist = self.distances(layout, a)
+        if dist[b] < 0:
+            return None
+        path = [(b, False)]
+        while path[-1][0] != a:
+            y = path[-1][0]
+            x = next((x for x in layout.land[y] if dist[x] == dist[y] - 1), None)
+            by_sea = x is None
+            if by_sea:
+                x = next(x for x in layout.ports if dist[x] == dist[y] - 1)
+            path[-1] = (y, by_sea)
+            path.append((x, False))
+        path.reverse()
+        return [(layout.names[i], by_sea) for i, by_sea in path]
+
+    def reachable(self, area_name: str, moves: int):
+        # {moves: [area names]} for everything 1..moves away
+        layout = self.ready()
+        dist = self.distances(layout, layout.index[area_name])
+        found = {}
+        for i in np.flatnonzero((dist > 0) & (dist <= moves)).tolist():
+            found.setdefault(int(dist[i]), []).append(layout.names[i])
+        return dict(sorted(found.items()))
+
+    def find(self, parent: dict, name: str):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    def link(self, parent: dict, area: Area):
+        # join a newly held area to whatever the same player already holds next to it, by land or by sea
+        layout = self.layout
+        parent[area.name] = area.name
+        i = layout.index.get(area.name)
+        if i is None:
+            return
+        linked = [layout.names[j] for j in layout.land[i]]
+        if layout.is_port[i]:
+            parent.setdefault(None, None)       # the sea, every held port joins through it
+            linked.append(None)
+        for neighbour in linked:
+            if neighbour in parent:
+                parent[self.find(parent, neighbour)] = self.find(parent, area.name)
+
+    def area_gained(self, player_name: str, area: Area):
+        if player_name in self.supply and self.layout is not None:
+            self.link(self.supply[player_name], area)
+
+    def area_lost(self, player_name: str):
+        self.supply.pop(player_name, None)     # a union-find can't split, rebuilt for this player on the next query
+
+    def networks(self, player: Player):
+        # the player's areas grouped into separately supplied networks, largest first
+        self.ready()
+        if player.name not in self.supply:
+            parent = {}
+            for area in sorted(player.areas, key=lambda a: a.name):
+                self.link(parent, area)
+            self.supply[player.name] = parent
+        parent = self.supply[player.name]
+        groups = {}
+        for name in parent:
+            if name is not None:
+                groups.setdefault(self.find(parent, name), []).append(name)
+        return sorted((sorted(group) for group in groups.values()), key=lambda group: (-len(group), group))
+
+class Histogram:
+    # cumulative buckets for Prometheus plus a window of recent samples for percentiles
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, math.inf)
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=1000)
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def percentile(self, fraction: float):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def prometheus(self, metric: str, labels: str = ""):
+        lines, total = [], 0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            total += count
+            le = "+Inf" if bound == math.inf else bound
+            lines.append(f'{metric}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {total}')
+        braces = f"{{{labels}}}" if labels else ""
+        lines.append(f"{metric}_sum{braces} {self.sum}")
+        lines.append(f"{metric}_count{braces} {self.count}")
+        return lines
+
+class Metrics:
+    # handler latency and errors, persistence and outbound send timings
+    ACK_DEADLINE = 3.0
+
+    def __init__(self):
+        self.handlers = {}
+        self.errors = {}
+        self.slow = {}
+        self.persistence = Histogram()
+        self.persistence_errors = 0
+        self.sends = Histogram()
+        self.send_errors = 0
+
+    def observe(self, name: str, seconds: float):
+        self.handlers.setdefault(name, Histogram()).observe(seconds)
+        if seconds > self.ACK_DEADLINE:
+            self.slow[name] = self.slow.get(name, 0) + 1
+
+    def error(self, name: str):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self):
+        # per-handler lines slowest first, then the totals
+        lines, totals = [], []
+        for name, h in sorted(self.handlers.items(), key=lambda item: -item[1].percentile(0.99)):
+            lines.append(f"**{name}**: {h.count} calls, p50 {1000*h.percentile(0.5):.0f}ms, p99 {1000*h.percentile(0.99):.0f}ms, "
+                         f"{self.errors.get(name, 0)} errors, {self.slow.get(name, 0)} over {self.ACK_DEADLINE:.0f}s")
+        deferred = ", ".join(f"{name} {count}" for name, count in sorted(guard.deferred.items()))
+        if deferred:
+            totals.append(f"**Auto-deferred**: {deferred}")
+        for label, h, errors in (("Saves", self.persistence, self.persistence_errors), ("Sends", self.sends, self.send_errors)):
+            totals.append(f"**{label}**: {h.count}, p50 {1000*h.percentile(0.5):.0f}ms, p99 {1000*h.percentile(0.99):.0f}ms, {errors} errors")
+        return lines, totals
+
+    def prometheus(self):
+        lines = ["# TYPE got_handler_seconds histogram"]
+        for name, h in sorted(self.handlers.items()):
+            lines += h.prometheus("got_handler_seconds", f'handler="{name}"')
+        lines.append("# TYPE got_handler_errors_total counter")
+        lines += [f'got_handler_errors_total{{handler="{name}"}} {count}' for name, count in sorted(self.errors.items())]
+        lines.append("# TYPE got_persistence_seconds histogram")
+        lines += self.persistence.prometheus("got_persistence_seconds")
+        lines.append(f"got_persistence_errors_total {self.persistence_errors}")
+        lines.append("# TYPE got_send_seconds histogram")
+        lines += self.sends.prometheus("got_send_seconds")
+        lines.append(f"got_send_errors_total {self.send_errors}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+DEFER_BUDGET = float(os.getenv("DEFER_BUDGET", "2.0"))
+
+class GuardedResponse:
+    # stands in for interaction.response, once the guard has deferred, replies go to the followup webhook
+    def __init__(self, interaction, ephemeral: bool):
+        self._interaction = interaction
+        self._response = interaction.response
+        self.lock = asyncio.Lock()
+        self.ephemeral = ephemeral
+        self.auto_deferred = False
+        self.replied_ephemeral = None
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def is_done(self):
+        return self._response.is_done()
+
+    async def auto_defer(self):
+        async with self.lock:
+            if not self._response.is_done():
+                await self._response.defer(ephemeral=self.ephemeral, thinking=True)
+                self.auto_deferred = True
+
+    async def defer(self, **kwargs):
+        async with self.lock:
+            if not self._response.is_done():     # the guard may have got there first
+                await self._response.defer(**kwargs)
+
+    async def send_message(self, content=None, **kwargs):
+        self.replied_ephemeral = kwargs.get("ephemeral", False)
+        async with self.lock:
+            if self.auto_deferred:
+                if self.replied_ephemeral != self.ephemeral:
+                    # the first followup would become the deferred message and keep its visibility,
+                    # so settle that one first and the reply goes out as a message of its own
+                    await self._interaction.edit_original_response(content="✅")
+                return await self._interaction.followup.send(content, **kwargs)
+            return await self._response.send_message(content, **kwargs)
+
+    async def send_modal(self, modal):
+        async with self.lock:
+            return await self._response.send_modal(modal)
+
+class GuardedInteraction:
+    def __init__(self, interaction, response: GuardedResponse):
+        self._interaction = interaction
+        self.response = response
+
+    def __getattr__(self, name):
+        return getattr(self._interaction, name)
+
+class DeferralGuard:
+    # defers a handler up front when its recent latency says it will miss the budget,
+    # or as soon as it actually runs past the budget
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.latency = {}       # exponentially weighted, per handler
+        self.ephemeral = {}     # whether the handler's last reply was ephemeral, for handlers that don't declare it
+        self.deferred = {}
+
+    def learn(self, label: str, seconds: float, response: GuardedResponse):
+        previous = self.latency.get(label)
+        self.latency[label] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+        if response.replied_ephemeral is not None:
+            self.ephemeral[label] = response.replied_ephemeral
+        if response.auto_deferred:
+            self.deferred[label] = self.deferred.get(label, 0) + 1
+
+    async def run(self, label: str, func, args, kwargs, ephemeral: bool | None = None):
+        position = next((i for i, arg in enumerate(args) if hasattr(arg, "response")), None)
+        if position is None:
+            return await func(*args, **kwargs)
+        interaction = args[position]
+        # a defer fixes the visibility of the first reply, so declared visibility wins, then what was learned, then public
+        response = GuardedResponse(interaction, ephemeral if ephemeral is not None else self.ephemeral.get(label, False))
+        args = args[:position] + (GuardedInteraction(interaction, response),) + args[position+1:]
+
+        if self.latency.get(label, 0.0) > self.budget:
+            await response.auto_defer()
+        watchdog = asyncio.create_task(self.watch(response))
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            watchdog.cancel()
+            self.learn(label, time.perf_counter() - start, response)
+
+    async def watch(self, response: GuardedResponse):
+        await asyncio.sleep(self.budget)
+        await response.auto_defer()
+
+guard = DeferralGuard(DEFER_BUDGET)
+
+def instrumented(func=None, name: str | None = None, guarded: bool = True, ephemeral: bool | None = None):
+    # wraps a command or ui callback, recording its latency and any exception it raises,
+    # guarded handlers are deferred automatically when they risk missing Discord's ack deadline,
+    # `ephemeral` is the visibility of the handler's main reply, which such a defer has to match
+    if func is None:
+        return functools.partial(instrumented, name=name, guarded=guarded, ephemeral=ephemeral)
+    label = name or func.__qualname__.removesuffix(".callback")
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            if guarded:
+                return await guard.run(label, func, args, kwargs, ephemeral)
+            return await func(*args, **kwargs)
+        except NoCampaign as e:
+            interaction = next(arg for arg in args if hasattr(arg, "response"))
+            if interaction.response.is_done():
+                await interaction.followup.send(f"❌ {e}", ephemeral=True)
+            else:
+                await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+        except Exception:
+            metrics.error(label)
+            raise
+        finally:
+            metrics.observe(label, time.perf_counter() - start)
+    return wrapper
+
+def write_atomic(filename: str, content: bytes):
+    # write to a temp file next to the target then swap it in, so a crash never leaves half a file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), prefix=".values-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, os.stat(filename).st_mode if os.path.exists(filename) else 0o644)     # mkstemp creates 0600
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def write_info(filename: str, data: dict):
+    write_atomic(filename, json.dumps(data, indent=2).encode())
+
+class JsonBackend:
+    # the whole campaign as one JSON document, every save rewrites every player
+    partial = False
+
+    def __init__(self, filename: str):
+        self.filename = filename
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return None
+        with open(self.filename, "r") as f:
+            return json.load(f)
+
+    def save(self, data: dict):
+        write_info(self.filename, data)
+
+    def stamp(self):
+        # changes whenever the file does, used to tell whether a snapshot is older than the data
+        if not os.path.exists(self.filename):
+            return None
+        st = os.stat(self.filename)
+        return (st.st_mtime_ns, st.st_size)
+
+class SqliteBackend:
+    # normalised tables, a save only rewrites the rows of the players it is given
+    partial = True
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS players (name TEXT PRIMARY KEY, ravens_left INTEGER);
+        CREATE TABLE IF NOT EXISTS resources (
+            player TEXT NOT NULL REFERENCES players(name), resource TEXT NOT NULL, amount INTEGER NOT NULL,
+            PRIMARY KEY (player, resource));
+        CREATE TABLE IF NOT EXISTS army (
+            player TEXT NOT NULL REFERENCES players(name), troop TEXT NOT NULL, amount INTEGER NOT NULL,
+            PRIMARY KEY (player, troop));
+        CREATE TABLE IF NOT EXISTS seals (
+            player TEXT NOT NULL REFERENCES players(name), house TEXT NOT NULL,
+            PRIMARY KEY (player, house));
+        CREATE TABLE IF NOT EXISTS areas (
+            area TEXT PRIMARY KEY, owner TEXT NOT NULL REFERENCES players(name));
+        CREATE INDEX IF NOT EXISTS areas_owner ON areas(owner);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+    """
+
+    def __init__(self, filename: str, legacy_json: str | None = None):
+        self.filename = filename
+        self.legacy_json = legacy_json
+        self.conn = sqlite3.connect(filename, check_same_thread=False)    # only the writer task or shutdown flush use it
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+        if "ravens_left" not in [row[1] for row in self.conn.execute("PRAGMA table_info(players)")]:
+            self.conn.execute("ALTER TABLE players ADD COLUMN ravens_left INTEGER")   # databases made before it was stored
+
+    def load(self):
+        data = {name: {"resources": {}, "areas": [], "army": {}, "seals": []}
+                for (name,) in self.conn.execute("SELECT name FROM players ORDER BY rowid")}
+        for name, ravens_left in self.conn.execute("SELECT name, ravens_left FROM players WHERE ravens_left IS NOT NULL"):
+            data[name]["ravens_left"] = ravens_left
+        if not data:
+            return self.migrate()
+        for player, resource, amount in self.conn.execute("SELECT player, resource, amount FROM resources ORDER BY rowid"):
+            data[player]["resources"][resource] = amount
+        for player, troop, amount in self.conn.execute("SELECT player, troop, amount FROM army ORDER BY rowid"):
+            data[player]["army"][troop] = amount
+        for player, house in self.conn.execute("SELECT player, house FROM seals"):
+            data[player]["seals"].append(house)
+        for area, owner in self.conn.execute("SELECT area, owner FROM areas"):
+            data[owner]["areas"].append(area)
+        return data
+
+    def migrate(self):
+        # first run on an empty database, import the old values.csv JSON if there is one
+        if self.legacy_json is None:
+            return None
+        data = JsonBackend(self.legacy_json).load()
+        if data is not None:
+            self.save(data)
+            print(f"📥 Imported {len(data)} players from {os.path.basename(self.legacy_json)} into {os.path.basename(self.filename)}")
+        return data
+
+    def save(self, data: dict):
+        with self.conn:     # one transaction per save
+            self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            for name, p in data.items():
+                self.conn.execute(
+                    "INSERT INTO players (name, ravens_left) VALUES (?, ?) "
+                    "ON CONFLICT (name) DO UPDATE SET ravens_left = excluded.ravens_left",
+                    (name, p.get("ravens_left")))
+                self.conn.executemany(
+                    "INSERT INTO resources (player, resource, amount) VALUES (?, ?, ?) "
+                    "ON CONFLICT (player, resource) DO UPDATE SET amount = excluded.amount",
+                    [(name, k, v) for k, v in p.get("resources", {}).items()])
+                self.conn.executemany(
+                    "INSERT INTO army (player, troop, amount) VALUES (?, ?, ?) "
+                    "ON CONFLICT (player, troop) DO UPDATE SET amount = excluded.amount",
+                    [(name, k, v) for k, v in p.get("army", {}).items()])
+                self.conn.execute("DELETE FROM seals WHERE player = ?", (name,))
+                self.conn.executemany("INSERT INTO seals (player, house) VALUES (?, ?)",
+                    [(name, house) for house in p.get("seals", [])])
+                self.conn.execute("DELETE FROM areas WHERE owner = ?", (name,))
+                self.conn.executemany(
+                    "INSERT INTO areas (area, owner) VALUES (?, ?) ON CONFLICT (area) DO UPDATE SET owner = excluded.owner",
+                    [(area, name) for area in p.get("areas", [])])
+
+    def stamp(self):
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+class StorageWriter:
+    # marks players dirty and coalesces bursts of mutations into one background save per interval
+    def __init__(self, info: Storage, backend, interval: float):
+        self.info = info
+        self.backend = backend
+        self.interval = interval
+        self.dirty = asyncio.Event()
+        self.pending = set()
+        self.everything = False
+        self.task = None
+        self.saving = threading.Lock()     # the background save and a final flush never overlap
+        self.turn = asyncio.Lock()         # copies are written in the order they were taken
+
+    def mark_dirty(self, names=None):
+        if names is None:
+            self.everything = True
+        else:
+            self.pending.update(names)
+        self.dirty.set()
+
+    def snapshot(self):
+        # taken on the loop, so the copy is consistent while a thread serialises it
+        names = None if self.everything or not self.backend.partial else self.pending
+        data = self.info.to_dict(names)
+        self.pending = set()
+        self.everything = False
+        self.dirty.clear()
+        return data
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await self.dirty.wait()
+            await asyncio.sleep(self.interval)
+            await self.write()
+
+    async def write(self):
+        # everything pending, copied on the loop and saved from a thread; a failure leaves it pending for the next try
+        async with self.turn:
+            if not self.dirty.is_set():
+                return True
+            data = self.snapshot()
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.save, data)
+            except Exception as e:     # anything, a dead writer task would silently stop every later save
+                print(f"⚠️ Failed to store info: {e!r}")
+                metrics.persistence_errors += 1
+                self.mark_dirty(data.keys())
+                return False
+            metrics.persistence.observe(time.perf_counter() - start)
+            return True
+
+    def save(self, data: dict):
+        with self.saving:
+            self.backend.save(data)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+STORE_INTERVAL = float(os.getenv("STORE_INTERVAL", "2"))
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+
+def open_backend(directory: str):
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteBackend(os.path.join(directory,"values.db"), legacy_json=os.path.join(directory,"values.csv"))
+    return JsonBackend(os.path.join(directory,"values.csv"))
+
+def store_info(campaign, *player_names: str):
+    # only the named players are rewritten by row-level backends, no names means everyone
+    campaign.version += 1
+    campaign.economy.invalidate()
+    campaign.renders.bump(player_names or None)
+    campaign.writer.mark_dirty(player_names or None)
+
+def retrieve_info(campaign):
+    info = campaign.info
+    data = campaign.backend.load()
+    if data is None:
+        campaign.backend.save(info.to_dict())
+        data = info.to_dict()
     info.from_dict(data)
 
-def username_to_name(username: str):
-    for player in players:
-        if player[1] == username:
-            return player[0]
+# optional binary snapshot of the linked areas/players graph, written on shutdown and loaded in one read
+SNAPSHOT = os.getenv("SNAPSHOT", "0") == "1"
+SNAPSHOT_MAGIC = b"GOTS"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sH32s32s")     # magic, version, source key, payload sha256
+
+def snapshot_key(campaign):
+    # anything that would make the snapshot disagree with a normal load: the map, roster, code and saved state
+    key = hashlib.sha256()
+    with open(campaign.map_file, "rb") as f:
+        key.update(f.read())
+    with open(os.path.abspath(__file__), "rb") as f:
+        key.update(f.read())
+    key.update(repr(campaign.registry.entries).encode())
+    key.update(repr(campaign.backend.stamp()).encode())
+    return key.digest()
+
+def save_snapshot(campaign):
+    info = campaign.info
+    payload = pickle.dumps((info.players, info.areas), protocol=pickle.HIGHEST_PROTOCOL)
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, snapshot_key(campaign), hashlib.sha256(payload).digest())
+    write_atomic(campaign.snapshot_file, header + payload)
+
+def load_snapshot(campaign):
+    try:
+        with open(campaign.snapshot_file, "rb") as f:
+            data = f.read()
+    except OSError:
+        return False
+    if len(data) < SNAPSHOT_HEADER.size:
+        return False
+    magic, version, key, digest = SNAPSHOT_HEADER.unpack_from(data)
+    payload = memoryview(data)[SNAPSHOT_HEADER.size:]
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or key != snapshot_key(campaign):
+        print("⚠️ Snapshot is stale, loading from the map and saved values.")
+        return False
+    if hashlib.sha256(payload).digest() != digest:
+        print("⚠️ Snapshot checksum mismatch, loading from the map and saved values.")
+        return False
+    campaign.info.players, campaign.info.areas = pickle.loads(payload)
+    return True
+
+def apply_registry(campaign):
+    # bring info.players in line with the roster without touching anyone's game state
+    info, registry = campaign.info, campaign.registry
+    for name, username, channel, raven_limit, user_id in registry.entries:
+        if name in info.players:
+            p = info.players[name]
+            p.username, p.channel, p.raven_limit = username, channel, raven_limit
+        else:
+            info.players[name] = Player(name, username, channel, raven_limit)
+    removed = [name for name in info.players if name not in registry.by_name]
+    for name in removed:
+        for area in list(info.players[name].areas):
+            area.owner = None
+        del info.players[name]
+    return removed
+
+class TransactionError(Exception):
+    pass
+
+class LockManager:
+    # per-player and per-area locks, always taken in sorted order so two transactions can't deadlock
+    def __init__(self):
+        self.locks = {}
+        self.acquired = 0
+        self.contended = 0
+        self.wait_time = 0.0
+        self.longest_wait = 0.0
+
+    async def acquire(self, keys):
+        held = []
+        try:
+            for key in sorted(keys):
+                lock = self.locks.setdefault(key, asyncio.Lock())
+                if lock.locked():
+                    self.contended += 1
+                    start = time.monotonic()
+                    await lock.acquire()
+                    waited = time.monotonic() - start
+                    self.wait_time += waited
+                    self.longest_wait = max(self.longest_wait, waited)
+                else:
+                    await lock.acquire()
+                held.append(key)
+                self.acquired += 1
+        except BaseException:   # cancelled while waiting for a later key, the earlier ones would be held forever
+            self.release(held)
+            raise
+
+    def release(self, keys):
+        for key in sorted(keys, reverse=True):
+            self.locks[key].release()
+
+    def stats(self):
+        return {"acquired": self.acquired, "contended": self.contended,
+                "avg_wait_ms": 1000 * self.wait_time / self.contended if self.contended else 0.0,
+                "longest_wait_ms": 1000 * self.longest_wait}
+
+class Transaction:
+    # collects resource, army and area changes under the relevant locks, checks them all,
+    # then applies them together and stores once; raising TransactionError inside discards everything
+    def __init__(self, campaign, players=(), areas=()):
+        self.campaign = campaign
+        self.info = campaign.info
+        self.player_names = set(players)
+        self.area_names = set(areas)
+        self.keys = {("player", name) for name in self.player_names} | {("area", name) for name in self.area_names}
+        self.resources = {}
+        self.army = {}
+        self.area_changes = []
+
+    async def __aenter__(self):
+        await self.campaign.locks.acquire(self.keys)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            self.campaign.locks.release(self.keys)
+        return False
+
+    def change(self, player_name: str, resource: str, amount: int):
+        if player_name not in self.player_names:
+            raise RuntimeError(f"{player_name} is not locked by this transaction")
+        changes = self.resources.setdefault(player_name, {})
+        changes[resource] = changes.get(resource, 0) + amount
+
+    def change_army(self, player_name: str, troop: str, amount: int):
+        if player_name not in self.player_names:
+            raise RuntimeError(f"{player_name} is not locked by this transaction")
+        changes = self.army.setdefault(player_name, {})
+        changes[troop] = changes.get(troop, 0) + amount
+
+    def adjust_area(self, area: Area, resource: str, amount: int):
+        if area.name not in self.area_names:
+            raise RuntimeError(f"{area.name} is not locked by this transaction")
+        self.area_changes.append((area, resource, amount))
+
+    def validate(self):
+        for player_name, changes in self.resources.items():
+            resources = self.info.players[player_name].resources
+            for resource, amount in changes.items():
+                if resource not in RESOURCE_SLOTS:
+                    raise TransactionError(f"{resource} is not a resource")
+                if amount < 0 and resources.get(resource, 0) + amount < 0:
+                    raise TransactionError(f"{player_name.title()} lacks sufficient {resource}")
+
+    def commit(self):
+        self.validate()
+        for player_name, changes in self.resources.items():
+            resources = self.info.players[player_name].resources
+            for resource, amount in changes.items():
+                resources[resource] = resources.get(resource, 0) + amount
+        for player_name, changes in self.army.items():
+            for troop, amount in changes.items():
+                self.info.players[player_name].change_army(troop, amount)
+        owners = set()
+        for area, resource, amount in self.area_changes:
+            area.adjust(resource, amount)
+            if area.owner is not None:
+                owners.add(area.owner.name)
+            if resource == "port":
+                self.campaign.graph.invalidate()    # sea links changed
+        touched = set(self.resources) | set(self.army) | owners
+        if touched or self.area_changes:
+            store_info(self.campaign, *touched)
+
+class NameIndex:
+    # sorted lower-case names for bisect prefix lookups, with substring and trigram-fuzzy fallbacks,
+    # rebuilt from its source only after invalidate()
+    def __init__(self, source):
+        self.source = source
+        self.keys = []
+        self.names = {}
+        self.trigrams = {}
+        self.stale = True
+
+    @staticmethod
+    def grams(key: str):
+        padded = f" {key} "
+        return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+    def invalidate(self):
+        self.stale = True
+
+    def build(self):
+        self.names = {name.lower(): name for name in self.source()}
+        self.keys = sorted(self.names)
+        self.trigrams = {}
+        for key in self.keys:
+            for gram in self.grams(key):
+                self.trigrams.setdefault(gram, []).append(key)
+        self.stale = False
+
+    def fuzzy(self, key: str, limit: int):
+        # only names sharing the most trigrams with the typo are scored properly
+        shared = Counter()
+        for gram in self.grams(key):
+            shared.update(self.trigrams.get(gram, ()))
+        scored = [(difflib.SequenceMatcher(None, key, candidate).ratio(), candidate) for candidate, _ in shared.most_common(50)]
+        return [candidate for ratio, candidate in sorted(scored, reverse=True) if ratio >= 0.6][:limit]
+
+    def resolve(self, text: str):
+        # case-insensitive exact match, or None
+        if self.stale:
+            self.build()
+        return self.names.get(text.strip().lower())
+
+    def complete(self, text: str, limit: int = 25):
+        if self.stale:
+            self.build()
+        key = text.strip().lower()
+        start = bisect.bisect_left(self.keys, key)
+        matches = []
+        for candidate in self.keys[start:start + limit]:
+            if not candidate.startswith(key):
+                break
+            matches.append(candidate)
+        if key and len(matches) < limit:
+            matches += [candidate for candidate in self.keys if key in candidate and candidate not in matches][:limit - len(matches)]
+        if key and len(matches) < limit:
+            matches += [candidate for candidate in self.fuzzy(key, limit) if candidate not in matches]
+        return [self.names[candidate] for candidate in matches[:limit]]
+
+resource_index = NameIndex(lambda: RESOURCES)
+
+def choices(names):
+    return [app_commands.Choice(name=name, value=name) for name in names]
+
+async def complete_player(interaction: Interaction, current: str):
+    campaign = await campaigns.find(interaction)
+    return choices(campaign.player_index.complete(current)) if campaign else []
+
+async def complete_area(interaction: Interaction, current: str):
+    campaign = await campaigns.find(interaction)
+    return choices(campaign.area_index.complete(current)) if campaign else []
+
+async def complete_redistrict_area(interaction: Interaction, current: str):
+    campaign = await campaigns.find(interaction)
+    return choices((["DM"] if "dm".startswith(current.lower()) else []) + (campaign.area_index.complete(current, 24) if campaign else []))
+
+async def complete_resource(interaction: Interaction, current: str):
+    return choices(resource_index.complete(current))
+
+async def complete_seal(interaction: Interaction, current: str):
+    # only the seals the chosen player actually holds
+    campaign = await campaigns.find(interaction)
+    player = campaign.info.players.get(getattr(interaction.namespace, "player_name", None) or "") if campaign else None
+    seals = sorted(player.seals) if player else []
+    return choices([seal for seal in seals if current.lower() in seal.lower()][:25])
 
 intents = discord.Intents.default()
 bot = commands.Bot(command_prefix="!", intents=intents)
-retrieve_info(info=info)
+
+class TokenBucket:
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    async def take(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+class Dispatcher:
+    # every outbound channel message goes through here: channels are sent to concurrently,
+    # each channel keeps its order and its own rate-limit bucket, 429s and 5xx are retried with backoff
+    def __init__(self, client: discord.Client, rate: int = 5, per: float = 5.0, retries: int = 4, idle: float = 60.0):
+        self.client = client
+        self.rate = rate
+        self.per = per
+        self.retries = retries
+        self.idle = idle
+        self.queues = {}
+        self.buckets = {}
+
+    async def send(self, channel_id: int, content: str, wait: bool = False, **kwargs):
+        # returns once queued, or once delivered with wait=True, the future resolves to the sent message
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())     # failures are already logged
+        if channel_id not in self.queues:
+            self.queues[channel_id] = asyncio.Queue()
+            self.buckets.setdefault(channel_id, TokenBucket(self.rate, self.per))
+            asyncio.create_task(self.worker(channel_id))
+        self.queues[channel_id].put_nowait((content, kwargs, future))
+        if wait:
+            return await future
+        return future
+
+    async def worker(self, channel_id: int):
+        queue = self.queues[channel_id]
+        while True:
+            try:
+                content, kwargs, future = await asyncio.wait_for(queue.get(), self.idle)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    del self.queues[channel_id]
+                    return
+                continue
+            try:
+                future.set_result(await self.deliver(channel_id, content, **kwargs))
+            except Exception as e:
+                print(f"⚠️ Failed to send to channel {channel_id}: {e}")
+                future.set_exception(e)
+
+    async def deliver(self, channel_id: int, content: str, **kwargs):
+        channel = self.client.get_channel(channel_id)
+        if channel is None:
+            channel = await self.client.fetch_channel(channel_id)
+        for attempt in range(self.retries + 1):
+            await self.buckets[channel_id].take()
+            start = time.perf_counter()
+            try:
+                message = await channel.send(content, **kwargs)
+                metrics.sends.observe(time.perf_counter() - start)
+                return message
+            except discord.HTTPException as e:
+                metrics.send_errors += 1
+                if attempt == self.retries or not (e.status == 429 or e.status >= 500):
+                    raise
+                retry_after = e.response.headers.get("Retry-After") if e.response is not None else None
+                await asyncio.sleep(float(retry_after) if retry_after else 2 ** attempt)
+
+dispatcher = Dispatcher(bot)
+
+class RavenQueue:
+    # ravens are journalled to disk before the sender is answered, a background worker delivers them
+    # and anything still undelivered after a restart is picked up again
+    def __init__(self, filename: str, retry: float = 30.0):
+        self.filename = filename
+        self.retry = retry
+        self.lock = threading.Lock()
+        self.pending = {}       # raven id -> [[channel, content, sent], ...]
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def append(self, record: dict, sync: bool = False):
+        with self.lock:
+            with open(self.filename, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue        # torn last line from a crash
+                if "raven" in record:
+                    self.pending[record["raven"]] = [[channel, content, False] for channel, content in record["deliveries"]]
+                elif "sent" in record and record["sent"] in self.pending:
+                    self.pending[record["sent"]][record["index"]][2] = True
+                elif "done" in record:
+                    self.pending.pop(record["done"], None)
+        self.compact()
+
+    def compact(self):
+        # rewrite the journal with just the undelivered parts of pending ravens
+        lines = [json.dumps({"raven": raven_id, "deliveries": [[channel, content] for channel, content, sent in deliveries if not sent]})
+                 for raven_id, deliveries in self.pending.items()]
+        for raven_id in self.pending:
+            self.pending[raven_id] = [d for d in self.pending[raven_id] if not d[2]]
+        with self.lock:
+            write_atomic(self.filename, "".join(line + "\n" for line in lines).encode())
+
+    async def submit(self, deliveries: list):
+        raven_id = uuid.uuid4().hex
+        self.pending[raven_id] = [[channel, content, False] for channel, content in deliveries]
+        await asyncio.to_thread(self.append, {"raven": raven_id, "deliveries": deliveries}, True)
+        self.queue.put_nowait(raven_id)
+        return raven_id
+
+    def start(self):
+        if self.task is None:
+            self.load()
+            if self.pending:
+                print(f"🪶 Resuming {len(self.pending)} undelivered ravens.")
+            for raven_id in self.pending:
+                self.queue.put_nowait(raven_id)
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            raven_id = await self.queue.get()
+            asyncio.create_task(self.deliver(raven_id))
+
+    async def deliver(self, raven_id: str):
+        deliveries = self.pending[raven_id]
+        # queue every part first so each channel keeps submission order, then wait for them together
+        futures = [(i, await dispatcher.send(d[0], d[1])) for i, d in enumerate(deliveries) if not d[2]]
+        retry = False
+        for index, future in futures:
+            try:
+                await future
+            except (discord.NotFound, discord.Forbidden):
+                pass        # the channel is gone, no point retrying
+            except Exception:
+                retry = True
+                continue
+            deliveries[index][2] = True
+            self.append({"sent": raven_id, "index": index})
+        if retry:
+            await asyncio.sleep(self.retry)
+            self.queue.put_nowait(raven_id)
+            return
+        self.append({"done": raven_id})
+        del self.pending[raven_id]
+        if not self.pending:
+            self.compact()
+
+WORD = re.compile(r"\w+")
+
+class RavenArchive:
+    # every raven ever sent, one JSON line each, never rewritten; the index maps each word, sender,
+    # recipient and seal to the ascending numbers of the ravens that have it, so a search only
+    # walks the shortest matching list and checks the others by bisection
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.offsets = array("q")
+        self.words = {}
+        self.senders = {}
+        self.recipients = {}
+        self.seals = {}
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, "rb+") as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break       # torn last line from a crash, cut off below so the next append starts clean
+                try:
+                    self.index(json.loads(line), offset)
+                except json.JSONDecodeError:
+                    pass
+                offset += len(line)
+            f.truncate(offset)
+
+    def index(self, record: dict, offset: int):
+        number = len(self.offsets)
+        self.offsets.append(offset)
+        keys = [(self.words, word) for word in set(WORD.findall(record["text"].lower()))]
+        keys += [(self.senders, record["sender"].lower()), (self.recipients, record["recipient"].lower())]
+        if record["seal"]:
+            keys.append((self.seals, record["seal"].lower()))
+        for postings, key in keys:
+            numbers = postings.get(key)
+            if numbers is None:
+                numbers = postings[key] = array("q")
+            numbers.append(number)
+
+    def write(self, record: dict):
+        with self.lock:
+            with open(self.filename, "ab") as f:
+                offset = f.tell()
+                f.write(json.dumps(record).encode() + b"\n")
+        return offset
+
+    async def append(self, record: dict):
+        # the file is written off the loop, the index is only ever touched on it
+        self.index(record, await asyncio.to_thread(self.write, record))
+
+    def search(self, words=(), sender=None, recipient=None, seal=None):
+        # numbers of the ravens matching every filter and containing every word, newest first
+        postings = [self.words.get(word, array("q")) for word in words]
+        for index, key in ((self.senders, sender), (self.recipients, recipient), (self.seals, seal)):
+            if key:
+                postings.append(index.get(key.lower(), array("q")))
+        if not postings:
+            return range(len(self.offsets) - 1, -1, -1)
+        postings.sort(key=len)
+        shortest, others = postings[0], postings[1:]
+        return [n for n in reversed(shortest) if all(self.contains(p, n) for p in others)]
+
+    @staticmethod
+    def contains(postings: array, number: int):
+        i = bisect.bisect_left(postings, number)
+        return i < len(postings) and postings[i] == number
+
+    def read(self, numbers):
+        with open(self.filename, "rb") as f:
+            records = []
+            for number in numbers:
+                f.seek(self.offsets[number])
+                records.append(json.loads(f.readline()))
+        return records
+
+WEEKLY_TICK = os.getenv("WEEKLY_TICK", "")     # e.g. "mon 18:00" (UTC), empty leaves the week to /weekly_update
+WEEK = datetime.timedelta(weeks=1)
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+class WeeklySchedule:
+    # when a campaign's week turns over and when it last did, kept in schedule.json so weeks missed
+    # while the bot was down (or the campaign unloaded) are still owed when it comes back
+    def __init__(self, filename: str, when: str = ""):
+        self.filename = filename
+        self.when = when
+        self.last = None
+        if when:
+            day, at = when.lower().split()
+            hour, minute = map(int, at.split(":"))
+            self.day, self.hour, self.minute = WEEKDAYS.index(day[:3]), hour, minute
+
+    def load(self):
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                self.last = datetime.datetime.fromisoformat(json.load(f)["last_tick"])
+
+    def save(self):
+        write_info(self.filename, {"last_tick": self.last.isoformat()})
+
+    def latest(self, now: datetime.datetime):
+        # the most recent scheduled instant at or before now
+        tick = now.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        tick -= datetime.timedelta(days=(now.weekday() - self.day) % 7)
+        return tick if tick <= now else tick - WEEK
+
+    def due(self, now: datetime.datetime):
+        # weeks owed since the last tick, a campaign seen for the first time starts from now and owes none
+        latest = self.latest(now)
+        if self.last is None:
+            self.last = latest
+            self.save()
+        return max(0, -(-(latest - self.last) // WEEK))
+
+class NoCampaign(Exception):
+    pass
+
+class Campaign:
+    # one guild's game: its map, roster and saved state, plus everything derived from them
+    def __init__(self, guild_id: int, directory: str):
+        self.guild_id = guild_id
+        self.directory = directory
+        self.map_file = os.path.join(directory,"resources.csv")
+        self.snapshot_file = os.path.join(directory,"values.snap")
+        self.registry = PlayerRegistry(os.path.join(directory,"players.csv"))
+        self.backend = open_backend(directory)
+        self.info = Storage(players=[])
+        self.version = 0        # bumped by every store_info, so anything derived from the whole state can tell it's stale
+        self.writer = StorageWriter(self.info, self.backend, STORE_INTERVAL)
+        self.economy = Economy()
+        self.renders = RenderCache()
+        self.graph = MapGraph(lambda: self.info.areas)
+        self.locks = LockManager()
+        self.raven_queue = RavenQueue(os.path.join(directory,"ravens.jsonl"))
+        self.archive = RavenArchive(os.path.join(directory,"raven_archive.jsonl"))
+        self.player_index = NameIndex(lambda: self.info.players)
+        self.area_index = NameIndex(lambda: self.info.areas)
+        self.raven_channel = DEFAULT_RAVEN if directory == BASE_DIR else None
+        self.schedule = WeeklySchedule(os.path.join(directory,"schedule.json"), WEEKLY_TICK)
+        self.weekly_task = None
+        self.used = time.monotonic()
+
+    def load(self):
+        # campaign.json is optional, {"raven_channel": <channel every raven is copied to>, "weekly_tick": "mon 18:00"}
+        settings_file = os.path.join(self.directory,"campaign.json")
+        if os.path.exists(settings_file):
+            with open(settings_file) as f:
+                settings = json.load(f)
+            self.raven_channel = settings.get("raven_channel", self.raven_channel)
+            self.schedule = WeeklySchedule(self.schedule.filename, settings.get("weekly_tick", self.schedule.when))
+        if self.schedule.when:
+            self.schedule.load()
+        self.registry.load()
+        self.archive.load()
+        self.attach(Storage(players=self.registry.entries))
+        if not (SNAPSHOT and load_snapshot(self)):
+            load_map(self)      # only parsed when there is no usable snapshot
+            retrieve_info(self)
+
+    def attach(self, info: Storage):
+        self.info = info
+        self.version += 1
+        self.writer.info = info
+        self.economy.invalidate()
+        self.renders.bump()
+        self.graph.invalidate()
+        self.player_index.invalidate()
+        self.area_index.invalidate()
+
+    def start(self):
+        self.writer.start()
+        self.raven_queue.start()
+        if self.schedule.when and self.weekly_task is None:
+            self.weekly_task = asyncio.create_task(self.run_weekly())
+
+    def advance(self, weeks: int = 1):
+        # growth minus upkeep times `weeks` in one step, ravens refill once however many weeks passed
+        self.economy.tick(self.info, weeks)
+        for player in self.info.players.values():
+            player.weekly_addition()
+        store_info(self)
+
+    async def run_weekly(self):
+        owed = None     # (weeks, tick) applied in memory but not yet on disk, saved again until it sticks
+        while True:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            try:
+                if owed is None:
+                    weeks = self.schedule.due(now)
+                    if weeks:
+                        self.advance(weeks)
+                        owed = (weeks, self.schedule.latest(now))
+                if owed is not None:
+                    weeks, tick = owed
+                    # the new week is on disk before the schedule says it happened
+                    if not await self.writer.write():
+                        await asyncio.sleep(self.writer.interval)
+                        continue
+                    previous, self.schedule.last = self.schedule.last, tick
+                    try:
+                        await asyncio.to_thread(self.schedule.save)
+                    except BaseException:
+                        self.schedule.last = previous
+                        raise
+                    owed = None
+                    print(f"📈 Guild {self.guild_id} advanced {weeks} week{'s' if weeks > 1 else ''}.")
+                    if self.raven_channel:
+                        await dispatcher.send(self.raven_channel, f"📈 Weekly resources added{f' for {weeks} missed weeks' if weeks > 1 else ''}!")
+            except Exception as e:     # a dead task would stop every later week until a restart
+                print(f"⚠️ Guild {self.guild_id} weekly tick failed: {e!r}")
+                metrics.persistence_errors += 1
+                await asyncio.sleep(self.writer.interval)
+                continue
+            await asyncio.sleep((self.schedule.latest(now) + WEEK - now).total_seconds())
+
+    def busy(self):
+        # ravens still in flight or a transaction holding locks, evicting now would lose them
+        return bool(self.raven_queue.pending) or any(lock.locked() for lock in self.locks.locks.values())
+
+    def stop(self):
+        # on the loop: background tasks end and whatever is unsaved is copied, for save() to write from a thread
+        if self.weekly_task is not None:
+            self.weekly_task.cancel()
+            self.weekly_task = None
+        self.writer.stop()
+        self.raven_queue.stop()
+        offload.forget(self)
+        return self.writer.snapshot() if self.writer.dirty.is_set() else None
+
+    def save(self, data):
+        if data is not None:
+            self.writer.save(data)
+        if SNAPSHOT:
+            save_snapshot(self)
+
+    def close(self):
+        # synchronous, once the loop has stopped
+        self.save(self.stop())
+
+CAMPAIGN_CACHE = int(os.getenv("CAMPAIGN_CACHE", "8"))
+CAMPAIGN_IDLE = float(os.getenv("CAMPAIGN_IDLE", "300"))
+
+class CampaignManager:
+    # guild id -> campaign, loaded on first use and the least recently used closed once more than `size` are loaded;
+    # a campaign used in the last `idle` seconds is kept regardless, its open views still point at its objects
+    def __init__(self, size: int, idle: float):
+        self.size = size
+        self.idle = idle
+        self.loaded = OrderedDict()
+        self.loading = {}
+        self.closing = {}   # guild id -> (campaign, task) still saving after eviction
+
+    def directory(self, guild_id: int):
+        return BASE_DIR if guild_id == GUILD_ID else os.path.join(CAMPAIGNS_DIR, str(guild_id))
+
+    def guilds(self):
+        # every guild with a map on disk
+        found = [GUILD_ID]
+        if os.path.isdir(CAMPAIGNS_DIR):
+            found += [int(name) for name in sorted(os.listdir(CAMPAIGNS_DIR))
+                      if name.isdigit() and os.path.exists(os.path.join(CAMPAIGNS_DIR, name, "resources.csv"))]
+        return found
+
+    async def get(self, interaction):
+        guild_id = interaction.guild_id
+        campaign = self.loaded.get(guild_id)
+        if campaign is None:
+            if guild_id is None or not os.path.exists(os.path.join(self.directory(guild_id), "resources.csv")):
+                raise NoCampaign("There is no campaign in this server.")
+            if guild_id not in self.loading:    # two first interactions at once share one load
+                self.loading[guild_id] = asyncio.create_task(self.load(guild_id))
+            campaign = await asyncio.shield(self.loading[guild_id])
+        self.loaded.move_to_end(guild_id)
+        campaign.used = time.monotonic()
+        return campaign
+
+    async def find(self, interaction):
+        # get() for autocompletes, which have nowhere to report a missing campaign
+        try:
+            return await self.get(interaction)
+        except NoCampaign:
+            return None
+
+    async def load(self, guild_id: int):
+        try:
+            if guild_id in self.closing:    # evicted moments ago, read it back only once its save is on disk
+                await asyncio.shield(self.closing[guild_id][2])
+            campaign = Campaign(guild_id, self.directory(guild_id))
+            await asyncio.to_thread(campaign.load)
+            self.add(campaign)
+            print(f"📂 Loaded campaign for guild {guild_id}, {len(self.loaded)} in memory.")
+            return campaign
+        finally:
+            self.loading.pop(guild_id, None)
+
+    def add(self, campaign: Campaign):
+        previous = self.loaded.pop(campaign.guild_id, None)
+        if previous is not None and previous is not campaign:
+            self.retire(previous)
+        self.loaded[campaign.guild_id] = campaign
+        campaign.start()
+        self.evict()
+
+    def evict(self):
+        recent = time.monotonic() - self.idle
+        for guild_id, campaign in list(self.loaded.items()):
+            if len(self.loaded) <= self.size:
+                break
+            if campaign.used > recent or campaign.busy():
+                continue
+            del self.loaded[guild_id]
+            self.retire(campaign)
+            print(f"📂 Evicted campaign for guild {guild_id}.")
+
+    def retire(self, campaign: Campaign):
+        # tasks stop now, the final save and snapshot are written from a thread
+        data = campaign.stop()
+        task = asyncio.create_task(self.save(campaign, data))
+        self.closing[campaign.guild_id] = (campaign, data, task)
+
+    async def save(self, campaign: Campaign, data):
+        try:
+            await asyncio.to_thread(campaign.save, data)
+        except Exception as e:
+            print(f"⚠️ Failed to save campaign for guild {campaign.guild_id}: {e}")
+            metrics.persistence_errors += 1
+        finally:
+            if self.closing.get(campaign.guild_id, (None, None, None))[2] is asyncio.current_task():
+                del self.closing[campaign.guild_id]
+
+    def close(self):
+        for campaign, data, task in self.closing.values():
+            if not task.done():     # the loop stopped before its thread finished
+                campaign.save(data)
+        for campaign in self.loaded.values():
+            campaign.close()
+
+campaigns = CampaignManager(CAMPAIGN_CACHE, CAMPAIGN_IDLE)
 
 # ------------------------------------
 # Slash Commands
 # ------------------------------------
 @bot.tree.error
 async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    if interaction.command is not None and not isinstance(error, app_commands.CommandInvokeError):
+        metrics.error(interaction.command.name)     # failed checks never reach the handler wrapper
     if isinstance(error, app_commands.errors.MissingRole):
         await interaction.response.send_message("🚫 You don’t have permission to use this command.", ephemeral=True)
     else:
@@ -165,13 +1918,34 @@ async def on_app_command_error(interaction: discord.Interaction, error: app_comm
 @app_commands.checks.has_role("BOT-Control")
 @bot.tree.command(name="players", description="Show player profiles")
 async def players_cmd(interaction: discord.Interaction):
-    retrieve_info(info=info)
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
     await interaction.response.send_message(f"Player profiles\n{list(info.players.keys())}")
 
+@app_commands.checks.has_role("BOT-Control")
+@bot.tree.command(name="reload_players", description="Reload the roster from players.csv")
+async def reload_players(interaction: discord.Interaction):
+    campaign = await campaigns.get(interaction)
+    try:
+        campaign.registry.load()
+    except (OSError, ValueError) as e:
+        await interaction.response.send_message(f"❌ Roster not reloaded: {e}", ephemeral=True)
+        return
+    removed = apply_registry(campaign)
+    campaign.player_index.invalidate()
+    store_info(campaign)
+    message = f"🔁 Roster reloaded, {len(campaign.registry.entries)} players."
+    if removed:
+        message += f" Removed: {', '.join(removed)}"
+    await interaction.response.send_message(message, ephemeral=True)
+
 @bot.tree.command(name="resources", description="Show your current resources")
+@app_commands.autocomplete(player_name=complete_player)
 async def resources_cmd(interaction: discord.Interaction, player_name: str | None = None):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
     if player_name == None:
-        player_name = username_to_name(interaction.user.name)
+        player_name = campaign.registry.lookup(interaction.user)
     else:
         if not any(role.name == "BOT-Control" for role in interaction.user.roles):
             await interaction.response.send_message("🚫 You don’t have permission to use this command.", ephemeral=True)
@@ -179,17 +1953,17 @@ async def resources_cmd(interaction: discord.Interaction, player_name: str | Non
     if player_name not in info.players:
         await interaction.response.send_message("❌ That is not a valid user, use /players to see them all.")
         return
-    p = info.players[player_name]
-    res = p.resources.copy()
-    res.update({"port": p.port(), "fort": p.fort(), "population": p.population(), "city": p.city()})
-    formatted = "\n".join(f"**{k.title()}**: {v}" for k, v in res.items())
+    formatted = campaign.renders.render(info.players[player_name])["resources"]
     await interaction.response.send_message(f"📦 **{player_name}'s Resources:**\n{formatted}")
 
 
 @bot.tree.command(name="areas", description="Show your controlled areas")
+@app_commands.autocomplete(player_name=complete_player)
 async def areas_cmd(interaction: discord.Interaction, player_name: str | None = None):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
     if player_name == None:
-        player_name = username_to_name(interaction.user.name)
+        player_name = campaign.registry.lookup(interaction.user)
     else:
         if not any(role.name == "BOT-Control" for role in interaction.user.roles):
             await interaction.response.send_message("🚫 You don’t have permission to use this command.", ephemeral=True)
@@ -197,13 +1971,16 @@ async def areas_cmd(interaction: discord.Interaction, player_name: str | None =
     if player_name not in info.players:
         await interaction.response.send_message("❌ That is not a valid user, use /players to see them all.")
         return
-    area_list = ", ".join(a.name for a in info.players[player_name].areas) or "None"
+    area_list = campaign.renders.render(info.players[player_name])["areas"]
     await interaction.response.send_message(f"🏰 **{player_name}'s Areas:** {area_list}")
 
 @bot.tree.command(name="army", description="Show your army amounts")
+@app_commands.autocomplete(player_name=complete_player)
 async def army_cmd(interaction: discord.Interaction, player_name: str | None = None):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
     if player_name == None:
-        player_name = username_to_name(interaction.user.name)
+        player_name = campaign.registry.lookup(interaction.user)
     else:
         if not any(role.name == "BOT-Control" for role in interaction.user.roles):
             await interaction.response.send_message("🚫 You don’t have permission to use this command.", ephemeral=True)
@@ -211,15 +1988,73 @@ async def army_cmd(interaction: discord.Interaction, player_name: str | None = N
     if player_name not in info.players:
         await interaction.response.send_message("❌ That is not a valid user, use /players to see them all.")
         return
-    army = info.players[player_name].army
-    formatted = "\n".join(f"**{k.title()}**: {v}" for k, v in army.items())
+    formatted = campaign.renders.render(info.players[player_name])["army"]
     await interaction.response.send_message(f"⚔️ **{player_name}'s Army:**\n{formatted}")
 
+class PagedView(ui.View):
+    # previous/next buttons over `pages` pages, subclasses render the current page as message kwargs
+    def __init__(self, pages: int):
+        super().__init__(timeout=300)
+        self.page = 0
+        self.pages = max(1, pages)
+        self.previous_button = PageButton("◀", -1)
+        self.next_button = PageButton("▶", 1)
+        self.add_item(self.previous_button)
+        self.add_item(self.next_button)
+
+    def show(self, campaign):
+        self.previous_button.disabled = self.page == 0
+        self.next_button.disabled = self.page >= self.pages - 1
+        return self.render(campaign)
+
+    def render(self, campaign):
+        raise NotImplementedError
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+
+class PageButton(ui.Button):
+    def __init__(self, label: str, step: int):
+        super().__init__(label=label, style=discord.ButtonStyle.secondary)
+        self.step = step
+
+    @instrumented(guarded=False)     # the flip edits the message in place, which can't follow a defer
+    async def callback(self, interaction: Interaction):
+        campaign = await campaigns.get(interaction)
+        view: PagedView = self.view
+        view.page = min(max(view.page + self.step, 0), view.pages - 1)
+        await interaction.response.edit_message(**view.show(campaign), view=view)
+
+DASHBOARD_PAGE = 3     # players per page, each embed's areas field is capped so three stay under Discord's 6000 characters
+
+class DashboardView(PagedView):
+    def __init__(self, player_names: list[str]):
+        super().__init__(-(-len(player_names) // DASHBOARD_PAGE))
+        self.player_names = player_names
+
+    def render(self, campaign):
+        # the embeds come straight from the render cache
+        players = campaign.info.players
+        names = self.player_names[self.page * DASHBOARD_PAGE:(self.page + 1) * DASHBOARD_PAGE]
+        embeds = [campaign.renders.render(players[name])["embed"] for name in names if name in players]
+        return {"content": f"📊 **Dashboard** page {self.page + 1}/{self.pages}", "embeds": embeds}
+
+@app_commands.checks.has_role("BOT-Control")
+@bot.tree.command(name="dashboard", description="Every player's resources, areas and army, a few per page")
+async def dashboard(interaction: discord.Interaction):
+    campaign = await campaigns.get(interaction)
+    view = DashboardView(list(campaign.info.players))
+    await interaction.response.send_message(**view.show(campaign), view=view, ephemeral=True)
+
 @app_commands.checks.has_role("BOT-Control")
 @bot.tree.command(name="addarea", description="Claim an area")
 @app_commands.describe(area_name="The name of the area to claim")
+@app_commands.autocomplete(player_name=complete_player, area_name=complete_area)
 async def addarea(interaction: discord.Interaction, player_name: str, area_name: str):
-    area_name = area_name.capitalize()
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
+    area_name = campaign.area_index.resolve(area_name) or area_name
     if player_name not in info.players:
         await interaction.response.send_message("❌ That is not a valid user, use /players to see them all.")
         return
@@ -227,21 +2062,26 @@ async def addarea(interaction: discord.Interaction, player_name: str, area_name:
         await interaction.response.send_message("❌ That area doesn't exist.")
         return
     area = info.areas[area_name]
-    info.players[player_name].areas.add(area)
     previous_owner = area.owner
     message = f"✅ {player_name} has claimed the area **{area_name}**!"
     if not (previous_owner is None):
-        area.owner.areas.remove(area)
+        previous_owner.remove_area(area)
+        campaign.graph.area_lost(previous_owner.name)
         message += f" It has been stolen from {previous_owner.name}!!"
+    info.players[player_name].add_area(area)
     area.owner = info.players[player_name]
-    store_info(info=info)
+    campaign.graph.area_gained(player_name, area)
+    store_info(campaign, player_name, *([previous_owner.name] if previous_owner else []))
     await interaction.response.send_message(message)
 
 @app_commands.checks.has_role("BOT-Control")
 @bot.tree.command(name="removearea", description="Lose an area to a non-player")
 @app_commands.describe(area_name="The name of the area to lose")
+@app_commands.autocomplete(player_name=complete_player, area_name=complete_area)
 async def removearea(interaction: discord.Interaction, player_name: str, area_name: str):
-    area_name = area_name.capitalize()
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
+    area_name = campaign.area_index.resolve(area_name) or area_name
     if player_name not in info.players:
         await interaction.response.send_message("❌ That is not a valid user, use /players to see them all.")
         return
@@ -252,23 +2092,198 @@ async def removearea(interaction: discord.Interaction, player_name: str, area_na
         await interaction.response.send_message("❌ That player does not seem to own that area.")
         return
     info.areas[area_name].owner = None
-    info.players[player_name].areas.remove(info.areas[area_name])
-    store_info(info=info)
+    info.players[player_name].remove_area(info.areas[area_name])
+    campaign.graph.area_lost(player_name)
+    store_info(campaign, player_name)
     await interaction.response.send_message(f"✅ {player_name} has lost the area **{area_name}**!")
 
 @app_commands.checks.has_role("BOT-Control")
 @bot.tree.command(name="weekly_update", description="Apply weekly resource growth from your areas")
 async def weekly_update(interaction: discord.Interaction):
-    for player_name in info.players:
-        info.players[player_name].weekly_addition()
-    store_info(info=info)
+    campaign = await campaigns.get(interaction)
+    campaign.advance()
     await interaction.response.send_message(f"📈 Weekly resources added!")
 
 
+@offload.register
+def drifted_totals(state: Storage):
+    # players whose cached totals disagree with a full recount of their areas and army
+    return [p.name for p in state.players.values() if p.recompute() != (p.totals.copy(), p.troops)]
+
+@app_commands.checks.has_role("BOT-Control")
+@bot.tree.command(name="check_aggregates", description="Compare cached player totals against a full recount")
+async def check_aggregates(interaction: discord.Interaction):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        suspects = await offload.run(interaction, drifted_totals, campaign=campaign)
+    except OffloadError as e:
+        await interaction.followup.send(f"❌ {e}", ephemeral=True)
+        return
+    # the recount ran on a snapshot, the live players are checked again before being repaired
+    drifted = [name for name in suspects if name in info.players and not info.players[name].check_aggregates()]
+    campaign.renders.bump(drifted)
+    if drifted:
+        await interaction.followup.send(f"⚠️ Repaired drifted totals for: {', '.join(drifted)}", ephemeral=True)
+    else:
+        await interaction.followup.send("✅ All cached totals match.", ephemeral=True)
+
+@bot.tree.command(name="forecast", description="Project your resources some weeks ahead")
+@app_commands.describe(weeks="How many weeks ahead (1-52)")
+@app_commands.autocomplete(player_name=complete_player)
+async def forecast(interaction: discord.Interaction, weeks: int, player_name: str | None = None):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
+    if player_name == None:
+        player_name = campaign.registry.lookup(interaction.user)
+    else:
+        if not any(role.name == "BOT-Control" for role in interaction.user.roles):
+            await interaction.response.send_message("🚫 You don’t have permission to use this command.", ephemeral=True)
+            return
+    if player_name not in info.players:
+        await interaction.response.send_message("❌ That is not a valid user, use /players to see them all.")
+        return
+    if not 1 <= weeks <= 52:
+        await interaction.response.send_message("❌ Forecasts go from 1 to 52 weeks ahead.", ephemeral=True)
+        return
+    rows = campaign.economy.forecast(info, player_name, weeks)
+    lines = [f"**Week {week}**: " + ", ".join(f"{v} {k}" for k, v in zip(RESOURCES, row)) for week, row in enumerate(rows.tolist()) if week > 0]
+    starving = next((week for week, row in enumerate(rows.tolist()) if row[0] < 0), None)
+    if starving is not None:
+        lines.append(f"⚠️ Food runs out in week {starving}, the army eats more than the land grows.")
+    while len("\n".join(lines)) > 1900:     # keep the furthest weeks when it won't fit one message
+        lines.pop(0)
+    await interaction.response.send_message(f"🔮 **{player_name}'s forecast:**\n" + "\n".join(lines))
+
+@bot.tree.command(name="route", description="Fastest way for an army to get from one area to another")
+@app_commands.autocomplete(area_from=complete_area, area_to=complete_area)
+async def route(interaction: discord.Interaction, area_from: str, area_to: str):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
+    area_from = campaign.area_index.resolve(area_from) or area_from
+    area_to = campaign.area_index.resolve(area_to) or area_to
+    if area_from not in info.areas or area_to not in info.areas:
+        await interaction.response.send_message("❌ That area doesn't exist.", ephemeral=True)
+        return
+    path = await asyncio.to_thread(campaign.graph.route, area_from, area_to)
+    if path is None:
+        await interaction.response.send_message(f"❌ There is no way from **{area_from}** to **{area_to}**.", ephemeral=True)
+        return
+    legs = path[0][0] + "".join(f" {'⛵' if by_sea else '→'} {name}" for name, by_sea in path[1:])
+    await interaction.response.send_message(f"🗺️ **{area_from}** to **{area_to}** in {len(path) - 1} move{'s' if len(path) > 2 else ''}:\n{legs}")
+
+@bot.tree.command(name="reachable", description="Areas an army can reach within some moves")
+@app_commands.describe(moves="How many moves (1-10)")
+@app_commands.autocomplete(area_name=complete_area)
+async def reachable(interaction: discord.Interaction, area_name: str, moves: int):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
+    area_name = campaign.area_index.resolve(area_name) or area_name
+    if area_name not in info.areas:
+        await interaction.response.send_message("❌ That area doesn't exist.", ephemeral=True)
+        return
+    if not 1 <= moves <= 10:
+        await interaction.response.send_message("❌ Moves go from 1 to 10.", ephemeral=True)
+        return
+    found = await asyncio.to_thread(campaign.graph.reachable, area_name, moves)
+    lines = [f"**{distance} move{'s' if distance > 1 else ''}**: {', '.join(names)}" for distance, names in found.items()]
+    await interaction.response.send_message(f"🧭 **Within {moves} moves of {area_name}:**\n" + ("\n".join(lines) or "Nowhere"))
+
+@bot.tree.command(name="supply", description="Check whether your areas form one connected supply network")
+@app_commands.autocomplete(player_name=complete_player)
+async def supply(interaction: discord.Interaction, player_name: str | None = None):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
+    if player_name == None:
+        player_name = campaign.registry.lookup(interaction.user)
+    else:
+        if not any(role.name == "BOT-Control" for role in interaction.user.roles):
+            await interaction.response.send_message("🚫 You don’t have permission to use this command.", ephemeral=True)
+            return
+    if player_name not in info.players:
+        await interaction.response.send_message("❌ That is not a valid user, use /players to see them all.")
+        return
+    await asyncio.to_thread(campaign.graph.ready)     # the layout is built off the loop, the union-find is quick
+    networks = campaign.graph.networks(info.players[player_name])
+    if not networks:
+        await interaction.response.send_message(f"🏕️ **{player_name}** holds no areas.")
+    elif len(networks) == 1:
+        await interaction.response.send_message(f"✅ All of **{player_name}'s** areas are connected.")
+    else:
+        cut_off = "\n".join(", ".join(group) for group in networks[1:])
+        await interaction.response.send_message(f"⚠️ **{player_name}'s** areas are split into {len(networks)} networks. "
+                                                f"Cut off from {', '.join(networks[0])}:\n{cut_off}")
+
+@app_commands.checks.has_role("BOT-Control")
+@bot.tree.command(name="battle_odds", description="Simulate a battle many times and show the odds")
+@app_commands.describe(area_name="Where the defender is attacked, its forts help them (leave out for open field)")
+@app_commands.describe(naval="Fight with fleets and galleys at sea instead of troops on land")
+@app_commands.autocomplete(attacker=complete_player, defender=complete_player, area_name=complete_area)
+async def battle_odds(interaction: discord.Interaction, attacker: str, defender: str, area_name: str | None = None, naval: bool = False):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
+    if attacker not in info.players or defender not in info.players:
+        await interaction.response.send_message("❌ That is not a valid user, use /players to see them all.", ephemeral=True)
+        return
+    fort = 0
+    if area_name is not None:
+        area_name = campaign.area_index.resolve(area_name) or area_name
+        if area_name not in info.areas:
+            await interaction.response.send_message("❌ That area doesn't exist.", ephemeral=True)
+            return
+        fort = info.areas[area_name].fort
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        odds = await offload.run(interaction, simulate_battle, dict(info.players[attacker].army), dict(info.players[defender].army), fort, naval)
+    except OffloadError as e:
+        await interaction.followup.send(f"❌ {e}", ephemeral=True)
+        return
+    def losses(side):
+        return ", ".join(f"{amount:.1f} {UNITS[troop]['label']}" for troop, amount in odds[side].items() if amount >= 0.05) or "none"
+    where = f"at **{area_name}** (walls x{odds['walls']:.2f})" if area_name else "in the open field"
+    await interaction.followup.send(
+        f"🎲 **{attacker.title()}** attacking **{defender.title()}** {where}{' at sea' if naval else ''}, {BATTLE_SIMULATIONS} simulations:\n"
+        f"**{attacker.title()} wins**: {100*odds['attacker_wins']:.1f}%\n"
+        f"**{defender.title()} holds**: {100*(1 - odds['attacker_wins']):.1f}%\n"
+        f"**Expected {attacker.title()} losses**: {losses('attacker_losses')}\n"
+        f"**Expected {defender.title()} losses**: {losses('defender_losses')}\n"
+        f"**Average length**: {odds['rounds']:.1f} rounds", ephemeral=True)
+
+@bot.tree.command(name="cancel", description="Stop waiting on your slow commands that are still running")
+async def cancel(interaction: discord.Interaction):
+    stopped = offload.cancel(interaction.user.id)
+    if stopped:
+        await interaction.response.send_message(f"🛑 Cancelled: {', '.join(stopped)}", ephemeral=True)
+    else:
+        await interaction.response.send_message("Nothing of yours is running.", ephemeral=True)
+
+@app_commands.checks.has_role("BOT-Control")
+@bot.tree.command(name="contention", description="Show how often commands waited on each other's locks")
+async def contention(interaction: discord.Interaction):
+    campaign = await campaigns.get(interaction)
+    stats = campaign.locks.stats()
+    await interaction.response.send_message(
+        f"🔒 {stats['acquired']} locks taken, {stats['contended']} had to wait "
+        f"(avg {stats['avg_wait_ms']:.1f}ms, longest {stats['longest_wait_ms']:.1f}ms)", ephemeral=True)
+
+@app_commands.checks.has_role("BOT-Control")
+@bot.tree.command(name="metrics", description="Show handler latency, errors, saves and sends")
+async def metrics_cmd(interaction: discord.Interaction):
+    lines, totals = metrics.summary()
+    while lines and len("\n".join(lines + totals)) > 1900:
+        lines.pop()     # drop the fastest handlers first, the totals always stay
+    await interaction.response.send_message("📊 **Metrics**\n" + "\n".join(lines + totals), ephemeral=True)
+
+
 ## RAVENS ##
 @app_commands.checks.has_role("BOT-Control")
 @bot.tree.command(name="add_raven_seal", description="Give player a seal of a house")
+@app_commands.autocomplete(player_name=complete_player, house_name=complete_area)
 async def add_raven_seal(interaction: discord.Interaction, player_name: str, house_name: str):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
+    house_name = campaign.area_index.resolve(house_name) or house_name
     if player_name not in info.players:
         await interaction.response.send_message("❌ That is not a valid user, use /players to see them all.")
         return
@@ -277,12 +2292,15 @@ async def add_raven_seal(interaction: discord.Interaction, player_name: str, hou
         return
     player = info.players[player_name]
     player.seals.add(house_name)
-    store_info(info=info)
+    store_info(campaign, player_name)
     await interaction.response.send_message(f"💮 {player_name.capitalize()} has been given the {house_name} seal!")
 
 @app_commands.checks.has_role("BOT-Control")
 @bot.tree.command(name="remove_raven_seal", description="Give player a seal of a house")
+@app_commands.autocomplete(player_name=complete_player, house_name=complete_seal)
 async def remove_raven_seal(interaction: discord.Interaction, player_name: str, house_name: str):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
     if player_name not in info.players:
         await interaction.response.send_message("❌ That is not a valid user, use /players to see them all.")
         return
@@ -291,7 +2309,7 @@ async def remove_raven_seal(interaction: discord.Interaction, player_name: str,
         return
     player = info.players[player_name]
     player.seals.remove(house_name)
-    store_info(info=info)
+    store_info(campaign, player_name)
     await interaction.response.send_message(f"💮 {player_name.capitalize()} has lost the {house_name} seal!")
 
 class RavenModal(ui.Modal, title="Compose Your Raven"):
@@ -319,39 +2337,44 @@ class RavenModal(ui.Modal, title="Compose Your Raven"):
         )
         self.add_item(self.message)
 
+    @instrumented(ephemeral=True)
     async def on_submit(self, interaction: Interaction):
+        campaign = await campaigns.get(interaction)
+        info = campaign.info
         await interaction.response.defer(ephemeral=True)
         player_name = self.recipient
         if type(player_name) == ui.TextInput:
             player_name = player_name.value
         message = self.message.value
         seal = f"the **{self.seal.title()} seal**" if self.seal else "no seal"
-        destination = None
-        player_sender = info.players[username_to_name(interaction.user.name)]
+        player_sender = info.players[campaign.registry.lookup(interaction.user)]
         if player_sender.ravens_left <= 0:
-            sender_destination = interaction.client.get_channel(info.players[username_to_name(interaction.user.name)].channel)
-            await sender_destination.send(f"❌ You have send all your ravens this week.\nYour message was:\n{message}")
+            await interaction.followup.send(f"❌ You have send all your ravens this week.\nYour message was:\n{message}", ephemeral=True)
             return
+        deliveries = []
         if self.recipient == "Everyone":
             if player_sender.ravens_left != player_sender.raven_limit and player_sender.name != "ADMIN":
-                sender_destination = interaction.client.get_channel(info.players[username_to_name(interaction.user.name)].channel)
-                await sender_destination.send(f"❌ You can only send a raven to ALL if no other ravens have been sent this week.\nYour message was:\n{message}")
+                await interaction.followup.send(f"❌ You can only send a raven to ALL if no other ravens have been sent this week.\nYour message was:\n{message}", ephemeral=True)
                 return
             for name in info.players:
                 if name != "ADMIN":
-                    destination = interaction.client.get_channel(info.players[name].channel)
-                    await destination.send(f"🪶 **Raven to {name.title()}, sealed with {seal}:**\n{message}")
+                    deliveries.append([info.players[name].channel, f"🪶 **Raven to {name.title()}, sealed with {seal}:**\n{message}"])
             if player_sender.name != "ADMIN":
                 player_sender.ravens_left = 0
         elif player_name in info.players:
-            destination = interaction.client.get_channel(info.players[player_name].channel)
-            await destination.send(f"🪶 **Raven to {player_name.title()}, sealed with {seal}:**\n{message}")
-        destination = interaction.client.get_channel(DEFAULT_RAVEN)   # all ravens go to Charlie too
-        await destination.send(f"🪶 **Raven to {player_name.title()}, sealed with {seal} (from {self.sender_name}):**\n{message}")
-        sender_destination = interaction.client.get_channel(info.players[username_to_name(interaction.user.name)].channel)
+            deliveries.append([info.players[player_name].channel, f"🪶 **Raven to {player_name.title()}, sealed with {seal}:**\n{message}"])
+        # all ravens go to Charlie too, when this campaign has a raven channel
+        if campaign.raven_channel:
+            deliveries.append([campaign.raven_channel, f"🪶 **Raven to {player_name.title()}, sealed with {seal} (from {self.sender_name}):**\n{message}"])
         if self.recipient != "Everyone":
             player_sender.ravens_left -= 1
-        await sender_destination.send(f"✅ Raven sent to {player_name.title()} (seal {seal}). You have {player_sender.ravens_left} Ravens left.\nYour message was:\n{message}")
+        deliveries.append([player_sender.channel, f"✅ Raven sent to {player_name.title()} (seal {seal}). You have {player_sender.ravens_left} Ravens left.\nYour message was:\n{message}"])
+        store_info(campaign, player_sender.name)
+        await campaign.raven_queue.submit(deliveries)
+        await campaign.writer.write()   # the spent raven is on disk with the journal, a crash can't refund it
+        await interaction.followup.send(f"🪶 Your raven to {player_name.title()} has taken flight. You have {player_sender.ravens_left} Ravens left.", ephemeral=True)
+        await campaign.archive.append({"sender": player_sender.name, "recipient": player_name, "seal": self.seal,
+                                       "time": interaction.created_at.isoformat(), "text": message})
         print(f"Raven ({player_sender.name} -> {self.recipient}): {message}")
 
 class RavenRecipientView(ui.View):
@@ -372,26 +2395,28 @@ class RavenRecipientSelect(ui.Select):
             options=options
         )
 
+    @instrumented(ephemeral=True)
     async def callback(self, interaction: Interaction):
+        campaign = await campaigns.get(interaction)
+        info = campaign.info
         recipient = self.values[0]
-        sender_name = next((n for n, p in info.players.items() if p.username == interaction.user.name), None)
-        if not sender_name:
+        sender_name = campaign.registry.lookup(interaction.user)
+        if sender_name not in info.players:
             await interaction.response.send_message("❌ You are not registered as a player.", ephemeral=True)
             return
-        view = RavenSealView(sender_name, recipient)
+        view = RavenSealView(info.players[sender_name], recipient)
         if len(info.players[sender_name].seals) == 0:
             await interaction.response.send_message("", view=view, ephemeral=True)
         else:
             await interaction.response.send_message("💮 Choose a seal to affix (if any):", view=view, ephemeral=True)
 
 class RavenSealView(ui.View):
-    def __init__(self, sender_name: str, recipient: str):
+    def __init__(self, player: Player, recipient: str):
         super().__init__(timeout=60)
-        self.sender_name = sender_name
+        self.sender_name = player.name
         self.recipient = recipient
         self.selected_seal = None
 
-        player = info.players[sender_name]
         if player.seals:
             options = [discord.SelectOption(label=seal.title(), value=seal) for seal in player.seals]
             options.append(discord.SelectOption(label="No seal", value="no seal"))
@@ -410,6 +2435,7 @@ class RavenSealSelect(ui.Select):
             options=options
         )
 
+    @instrumented(ephemeral=True)
     async def callback(self, interaction: Interaction):
         view: RavenSealView = self.view
         view.selected_seal = self.values[0]
@@ -419,13 +2445,16 @@ class RavenSealConfirmButton(ui.Button):
     def __init__(self, recipient):
         super().__init__(label=f"Write your raven to {recipient}...", style=discord.ButtonStyle.primary)
 
+    @instrumented(guarded=False)     # a modal can't follow a defer
     async def callback(self, interaction: Interaction):
         view: RavenSealView = self.view
         await interaction.response.send_modal(RavenModal(view.recipient, view.sender_name, view.selected_seal))
 
 @bot.tree.command(name="raven", description="Send a raven to another character.")
 async def raven(interaction: Interaction):
-    player_name = username_to_name(interaction.user.name)
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
+    player_name = campaign.registry.lookup(interaction.user)
     player = info.players[player_name]
     if player.ravens_left <= 0:
         await interaction.response.send_message("❌ You have no Ravens left this week :(", ephemeral=True)
@@ -436,14 +2465,66 @@ async def raven(interaction: Interaction):
 
 @bot.tree.command(name="raven_refund", description="Send a raven to another character.")
 @app_commands.describe(player_name="Which player is being refunded a Raven?")
+@app_commands.autocomplete(player_name=complete_player)
 async def raven_refund(interaction: Interaction, player_name: str):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
     if player_name not in info.players:
         await interaction.response.send_message("❌ Invalid player name.", ephemeral=True)
         return
     player = info.players[player_name]
     player.ravens_left += 1
+    store_info(campaign, player_name)
     await interaction.response.send_message(f"🪶 {player_name.capitalize()} now up to {player.ravens_left} Ravens",ephemeral=True)
 
+RAVEN_PAGE = 5     # ravens per page, each clipped to an embed field's 1024 characters
+
+class RavenSearchView(PagedView):
+    def __init__(self, matches, query: str):
+        super().__init__(-(-len(matches) // RAVEN_PAGE))
+        self.matches = matches
+        self.query = query
+
+    def render(self, campaign):
+        numbers = self.matches[self.page * RAVEN_PAGE:(self.page + 1) * RAVEN_PAGE]
+        embed = discord.Embed(title=f"🪶 {len(self.matches)} ravens {self.query}".strip())
+        for record in campaign.archive.read(numbers):
+            seal = f"{record['seal'].title()} seal" if record["seal"] else "no seal"
+            text = record["text"] if len(record["text"]) <= 1024 else record["text"][:1023] + "…"
+            embed.add_field(name=f"{record['sender'].title()} → {record['recipient'].title()}, {seal}, {record['time'][:16].replace('T', ' ')}",
+                            value=text, inline=False)
+        return {"content": f"📜 **Raven archive** page {self.page + 1}/{self.pages}", "embeds": [embed]}
+
+async def complete_archived(interaction: Interaction, current: str, index: str):
+    # recipients and seals that actually appear in the archive, NPCs included
+    campaign = await campaigns.find(interaction)
+    keys = getattr(campaign.archive, index) if campaign else {}
+    return choices([key for key in keys if current.lower() in key][:25])
+
+async def complete_recipient(interaction: Interaction, current: str):
+    return await complete_archived(interaction, current, "recipients")
+
+async def complete_archived_seal(interaction: Interaction, current: str):
+    return await complete_archived(interaction, current, "seals")
+
+@app_commands.checks.has_role("BOT-Control")
+@bot.tree.command(name="raven_search", description="Search every raven sent in this campaign")
+@app_commands.describe(keywords="Words the raven must contain, all of them", sender="Who sent it",
+                       recipient="Who it was sent to", seal="The seal it was sealed with")
+@app_commands.autocomplete(sender=complete_player, recipient=complete_recipient, seal=complete_archived_seal)
+async def raven_search(interaction: Interaction, keywords: str | None = None, sender: str | None = None,
+                       recipient: str | None = None, seal: str | None = None):
+    campaign = await campaigns.get(interaction)
+    words = list(dict.fromkeys(WORD.findall((keywords or "").lower())))
+    matches = campaign.archive.search(words, sender, recipient, seal)
+    if not matches:
+        await interaction.response.send_message("📜 No ravens match.", ephemeral=True)
+        return
+    query = " ".join(part for part in (f"from {sender.title()}" if sender else "", f"to {recipient.title()}" if recipient else "",
+                                       f"with the {seal.title()} seal" if seal else "", f"mentioning {', '.join(words)}" if words else "") if part)
+    view = RavenSearchView(matches, query)
+    await interaction.response.send_message(**view.show(campaign), view=view, ephemeral=True)
+
 
 ## BUY TROOPS ##
 class ArmyView(ui.View):
@@ -497,6 +2578,7 @@ class ArmyNumberSelect(ui.Select):
             options=options
         )
 
+    @instrumented(ephemeral=True)
     async def callback(self, interaction: Interaction):
         view: ArmyBuyView = self.view
         view.num_selected = int(self.values[0])
@@ -505,12 +2587,8 @@ class ArmyNumberSelect(ui.Select):
 class ArmyTypeSelect(ui.Select):
     def __init__(self):
         options = [
-            discord.SelectOption(label="Men at Arms", value="men_at_arms", description="Cost: 1 food"),
-            discord.SelectOption(label="Archers", value="archers", description="Cost: 1 food, 1 wood"),
-            discord.SelectOption(label="Cavalry", value="cavalry", description="Cost: 2 food, 1 steel"),
-            discord.SelectOption(label="Siege Weapons", value="siege_weapons", description="Cost: 10 wood, 10 stone, 5 steel"),
-            discord.SelectOption(label="Fleet of Ships", value="fleet", description="Cost: 20 wood, 10 steel"),
-            discord.SelectOption(label="War Galley", value="war_galley", description="Cost: 10 wood, 10 steel"),
+            discord.SelectOption(label=unit["label"], value=troop, description=f"Cost: {format_cost(unit['cost'])}")
+            for troop, unit in UNITS.items()
         ]
         super().__init__(
             placeholder="Choose which troop type...",
@@ -519,6 +2597,7 @@ class ArmyTypeSelect(ui.Select):
             options=options
         )
 
+    @instrumented(ephemeral=True)
     async def callback(self, interaction: Interaction):
         view: ArmyBuyView = self.view
         view.troop_selected = self.values[0]
@@ -528,175 +2607,189 @@ class ArmyBuyConfirmButton(ui.Button):
     def __init__(self):
         super().__init__(label="Confirm Purchase", style=discord.ButtonStyle.success)
 
+    @instrumented(ephemeral=False)
     async def callback(self, interaction: Interaction):
+        campaign = await campaigns.get(interaction)
+        info = campaign.info
         view: ArmyBuyView = self.view
         if not view.num_selected or not view.troop_selected:
             await interaction.response.send_message("⚠️ Please select **both** the number of units and troop type before confirming.",ephemeral=True)
             return
-        if info.players[view.player_name].population() < view.num_selected:
-            await interaction.response.send_message("⚠️ Player lacks sufficient population")
+        cost = UNITS[view.troop_selected]["cost"]
+        try:
+            async with Transaction(campaign, players=[view.player_name]) as tx:
+                if info.players[view.player_name].population() < view.num_selected*UNITS[view.troop_selected]["population"]:
+                    raise TransactionError("Player lacks sufficient population")
+                for resource, amount in cost.items():
+                    tx.change(view.player_name, resource, -amount*view.num_selected)
+                tx.change_army(view.player_name, view.troop_selected, view.num_selected)
+        except TransactionError as e:
+            await interaction.response.send_message(f"⚠️ {e}")
             return
-
-        resources = info.players[view.player_name].resources
-        if view.troop_selected == "men_at_arms":
-            if resources["food"] >= view.num_selected:
-                resources["food"]-=view.num_selected
-            else:
-                await interaction.response.send_message("⚠️ Player lacks sufficient resources")
-                return
-        elif view.troop_selected == "archers":
-            if resources["food"] >= view.num_selected and resources["wood"] >= view.num_selected:
-                resources["food"]-=view.num_selected
-                resources["wood"]-=view.num_selected
-            else:
-                await interaction.response.send_message("⚠️ Player lacks sufficient resources")
-                return
-        elif view.troop_selected == "cavalry":
-            if resources["food"] >= view.num_selected*2 and resources["steel"] >= view.num_selected:
-                resources["food"]-= view.num_selected*2
-                resources["steel"]-= view.num_selected
-            else:
-                await interaction.response.send_message("⚠️ Player lacks sufficient resources")
-                return
-        elif view.troop_selected == "siege_weapons":
-            if resources["steel"] >= view.num_selected*5 and resources["wood"] >= view.num_selected*10 and resources["stone"] >= view.num_selected*10:
-                resources["steel"]-= view.num_selected*5
-                resources["wood"]-= view.num_selected*10
-                resources["stone"]-= view.num_selected*10
-            else:
-                await interaction.response.send_message("⚠️ Player lacks sufficient resources")
-                return
-        elif view.troop_selected == "fleet":
-            if resources["steel"] >= view.num_selected*10 and resources["wood"] >= view.num_selected*20:
-                resources["steel"]-= view.num_selected*10
-                resources["wood"]-= view.num_selected*20
-            else:
-                await interaction.response.send_message("⚠️ Player lacks sufficient resources")
-                return
-        elif view.troop_selected == "war_galley":
-            if resources["steel"] >= view.num_selected*10 and resources["wood"] >= view.num_selected*10:
-                resources["steel"]-= view.num_selected*10
-                resources["wood"]-= view.num_selected*10
-            else:
-                await interaction.response.send_message("⚠️ Player lacks sufficient resources")
-                return
-        info.players[view.player_name].army[view.troop_selected] += view.num_selected
         await interaction.response.send_message(
             f"🛡️ **{view.player_name.title()}** purchased **{view.num_selected} {view.troop_selected.title()}** units!",
             ephemeral=False)
         self.disabled = True
-        store_info(info=info)
 
 class ArmyRefundConfirmButton(ui.Button):
     def __init__(self):
         super().__init__(label="Confirm Refund", style=discord.ButtonStyle.success)
 
+    @instrumented(ephemeral=False)
     async def callback(self, interaction: Interaction):
+        campaign = await campaigns.get(interaction)
         view: ArmySellView = self.view
         if not view.num_selected or not view.troop_selected:
             await interaction.response.send_message("⚠️ Please select **both** the number of units and troop type before confirming.",ephemeral=True)
             return
-        info.players[view.player_name].army[view.troop_selected] = max(0, info.players[view.player_name].army[view.troop_selected]-view.num_selected)
-        if view.troop_selected == "men_at_arms":
-            info.players[view.player_name].resources["food"]+=view.num_selected
-        elif view.troop_selected == "archers":
-            info.players[view.player_name].resources["food"]+=view.num_selected
-            info.players[view.player_name].resources["wood"]+=view.num_selected
-        elif view.troop_selected == "cavalry":
-            info.players[view.player_name].resources["food"]+=view.num_selected*2
-            info.players[view.player_name].resources["steel"]+=view.num_selected
-        elif view.troop_selected == "siege_weapons":
-            info.players[view.player_name].resources["stone"]+=view.num_selected*10
-            info.players[view.player_name].resources["wood"]+=view.num_selected*10
-            info.players[view.player_name].resources["steel"]+=view.num_selected*5
-        elif view.troop_selected == "fleet":
-            info.players[view.player_name].resources["wood"]+=view.num_selected*20
-            info.players[view.player_name].resources["steel"]+=view.num_selected*10
-        elif view.troop_selected == "war_galley":
-            info.players[view.player_name].resources["wood"]+=view.num_selected*10
-            info.players[view.player_name].resources["steel"]+=view.num_selected*10
+        cost = UNITS[view.troop_selected]["cost"]
+        async with Transaction(campaign, players=[view.player_name]) as tx:
+            tx.change_army(view.player_name, view.troop_selected, -view.num_selected)
+            for resource, amount in cost.items():
+                tx.change(view.player_name, resource, amount*view.num_selected)
         await interaction.response.send_message(
             f"🛡️ **{view.player_name.title()}** refunded **{view.num_selected} {view.troop_selected.title()}** units!",
             ephemeral=False)
         self.disabled = True
-        store_info(info=info)
 
 class ArmySellConfirmButton(ui.Button):
     def __init__(self):
         super().__init__(label="Confirm Sale", style=discord.ButtonStyle.success)
 
+    @instrumented(ephemeral=False)
     async def callback(self, interaction: Interaction):
+        campaign = await campaigns.get(interaction)
         view: ArmySellView = self.view
         if not view.num_selected or not view.troop_selected:
             await interaction.response.send_message("⚠️ Please select **both** the number of units and troop type before confirming.",ephemeral=True)
             return
-        info.players[view.player_name].army[view.troop_selected] = max(0, info.players[view.player_name].army[view.troop_selected]-view.num_selected)
+        async with Transaction(campaign, players=[view.player_name]) as tx:
+            tx.change_army(view.player_name, view.troop_selected, -view.num_selected)
         await interaction.response.send_message(
             f"🛡️ **{view.player_name.title()}** sold **{view.num_selected} {view.troop_selected.title()}** units!",
             ephemeral=False)
         self.disabled = True
-        store_info(info=info)
 
 class ArmyGiveConfirmButton(ui.Button):
     def __init__(self):
         super().__init__(label="Confirm Gift", style=discord.ButtonStyle.success)
 
+    @instrumented(ephemeral=False)
     async def callback(self, interaction: Interaction):
+        campaign = await campaigns.get(interaction)
         view: ArmyGiveView = self.view
         if not view.num_selected or not view.troop_selected:
             await interaction.response.send_message("⚠️ Please select **both** the number of units and troop type before confirming.",ephemeral=True)
             return
-        info.players[view.player_name].army[view.troop_selected] += view.num_selected
+        async with Transaction(campaign, players=[view.player_name]) as tx:
+            tx.change_army(view.player_name, view.troop_selected, view.num_selected)
         await interaction.response.send_message(
             f"🛡️ **{view.player_name.title()}** gained **{view.num_selected} {view.troop_selected.title()}** units!",
             ephemeral=False)
         self.disabled = True
-        store_info(info=info)
 
 @app_commands.checks.has_role("BOT-Control")
 @bot.tree.command(name="armybuy", description="Purchase army resources.")
 @app_commands.describe(player_name="Which player is buying troops?")
+@app_commands.autocomplete(player_name=complete_player)
 async def armybuy(interaction: Interaction, player_name: str):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
     if player_name not in info.players:
         await interaction.response.send_message("❌ Invalid player name.", ephemeral=True)
         return
     view = ArmyBuyView(player_name)
-    store_info(info=info)
     await interaction.response.send_message(f"⚔️ **{player_name.title()}**, choose how many troops and what type to buy:",view=view,ephemeral=True)
 
 @app_commands.checks.has_role("BOT-Control")
 @bot.tree.command(name="armysell", description="Sell army resources.")
 @app_commands.describe(player_name="Which player is selling troops?")
+@app_commands.autocomplete(player_name=complete_player)
 async def armybuy(interaction: Interaction, player_name: str):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
     if player_name not in info.players:
         await interaction.response.send_message("❌ Invalid player name.", ephemeral=True)
         return
     view = ArmySellView(player_name)
-    store_info(info=info)
     await interaction.response.send_message(f"⚔️ **{player_name.title()}**, choose how many troops and what type to sell:",view=view,ephemeral=True)
 
 @app_commands.checks.has_role("BOT-Control")
 @bot.tree.command(name="armyrefund", description="Refund mistakenly bought army resources.")
 @app_commands.describe(player_name="Which player is refunding troops?")
+@app_commands.autocomplete(player_name=complete_player)
 async def armybuy(interaction: Interaction, player_name: str):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
     if player_name not in info.players:
         await interaction.response.send_message("❌ Invalid player name.", ephemeral=True)
         return
     view = ArmyRefundView(player_name)
-    store_info(info=info)
     await interaction.response.send_message(f"⚔️ **{player_name.title()}**, choose how many troops and what type to refund:",view=view,ephemeral=True)
 
 @app_commands.checks.has_role("BOT-Control")
 @bot.tree.command(name="armygive", description="Give army for free.")
 @app_commands.describe(player_name="Which player is refunding troops?")
+@app_commands.autocomplete(player_name=complete_player)
 async def armybuy(interaction: Interaction, player_name: str):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
     if player_name not in info.players:
         await interaction.response.send_message("❌ Invalid player name.", ephemeral=True)
         return
     view = ArmyGiveView(player_name)
-    store_info(info=info)
     await interaction.response.send_message(f"⚔️ **{player_name.title()}**, choose how many troops and what type to give:",view=view,ephemeral=True)
 
+def parse_order(order: str):
+    # "40 men at arms, 10 archers, 2 war_galley" -> {"men_at_arms": 40, "archers": 10, "war_galley": 2}
+    names = {troop: troop for troop in UNITS} | {unit["label"].lower().replace(" ", "_"): troop for troop, unit in UNITS.items()}
+    units = {}
+    for part in order.split(","):
+        if not part.strip():
+            continue
+        number, _, name = part.strip().partition(" ")
+        troop = names.get(name.strip().lower().replace(" ", "_"))
+        if not number.isdigit() or troop is None:
+            raise ValueError(f"Couldn't read **{part.strip()}**, use e.g. `40 men_at_arms, 10 archers`")
+        units[troop] = units.get(troop, 0) + int(number)
+    if not units:
+        raise ValueError("The order is empty.")
+    return units
+
+@app_commands.checks.has_role("BOT-Control")
+@bot.tree.command(name="armyorder", description="Buy a mix of troops in one go.")
+@app_commands.describe(player_name="Which player is buying troops?", order="e.g. 40 men_at_arms, 10 archers, 2 war_galley")
+@app_commands.autocomplete(player_name=complete_player)
+async def armyorder(interaction: Interaction, player_name: str, order: str):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
+    if player_name not in info.players:
+        await interaction.response.send_message("❌ Invalid player name.", ephemeral=True)
+        return
+    try:
+        units = parse_order(order)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+        return
+    cost = {}
+    for troop, number in units.items():
+        for resource, amount in UNITS[troop]["cost"].items():
+            cost[resource] = cost.get(resource, 0) + amount*number
+    population = sum(number*UNITS[troop]["population"] for troop, number in units.items())
+    try:
+        async with Transaction(campaign, players=[player_name]) as tx:
+            if info.players[player_name].population() < population:
+                raise TransactionError(f"Player lacks sufficient population ({population} needed)")
+            for resource, amount in cost.items():
+                tx.change(player_name, resource, -amount)
+            for troop, number in units.items():
+                tx.change_army(player_name, troop, number)
+    except TransactionError as e:
+        await interaction.response.send_message(f"⚠️ {e}. The order would cost {format_cost(cost)}.")
+        return
+    bought = ", ".join(f"{number} {UNITS[troop]['label']}" for troop, number in units.items())
+    await interaction.response.send_message(f"🛡️ **{player_name.title()}** mustered **{bought}** for {format_cost(cost)}!")
+
 
 ## REDISTRICT AREAS ##
 class RedistrictView(ui.View):
@@ -717,8 +2810,8 @@ class RedistricResourceSelect(ui.Select):
     def __init__(self, area_from, area_to):
         options = [
             discord.SelectOption(label=resource.title(), value=resource, 
-                    description=f"{area_from.name.title()} has {area_from.resources()[resource]}, {area_to.name.title()} has {area_to.resources()[resource]}")
-            for resource in area_from.resources() if area_from.resources()[resource]>0
+                    description=f"{area_from.name.title()} has {area_from.amount(resource)}, {area_to.name.title()} has {area_to.amount(resource)}")
+            for resource in RESOURCES + AREA_TOTALS if area_from.amount(resource)>0
         ]
         super().__init__(
             placeholder="Resource-square to reallocate...",
@@ -726,6 +2819,7 @@ class RedistricResourceSelect(ui.Select):
             max_values=1,
             options=options
         )
+    @instrumented(ephemeral=True)
     async def callback(self, interaction: Interaction):
         view: RedistrictView = self.view
         view.resource = self.values[0]
@@ -735,38 +2829,32 @@ class RedistrictConfirmButton(ui.Button):
     def __init__(self):
         super().__init__(label="Confirm Reallocation", style=discord.ButtonStyle.success)
 
+    @instrumented(ephemeral=False)
     async def callback(self, interaction: Interaction):
+        campaign = await campaigns.get(interaction)
         view: ArmySellView = self.view
         if not view.area_from or not view.area_to or not view.resource:
             await interaction.response.send_message("⚠️ Please select **both** areas and the resource before confirming.",ephemeral=True)
             return
-        if view.resource in view.area_from.growth:
-            view.area_from.growth[view.resource] -= 1
-            view.area_to.growth[view.resource] += 1
-        else:
-            if view.resource == "population":
-                view.area_from.population -= 1
-                view.area_to.population += 1
-            elif view.resource == "fort":
-                view.area_from.fort -= 1
-                view.area_to.fort += 1
-            elif view.resource == "port":
-                view.area_from.port -= 1
-                view.area_to.port += 1
-            elif view.resource == "city":
-                view.area_from.city -= 1
-                view.area_to.city += 1
+        areas = (view.area_from, view.area_to)
+        async with Transaction(campaign, players=[area.owner.name for area in areas if area.owner], areas=[area.name for area in areas]) as tx:
+            tx.adjust_area(view.area_from, view.resource, -1)
+            tx.adjust_area(view.area_to, view.resource, 1)
         await interaction.response.send_message(
             f"🔁 **{view.area_from.name.title()}** lost 1 **{view.resource} to {view.area_to.name.title()}**!",
             ephemeral=False)
         self.disabled = True
-        store_info(info=info)
 
 @app_commands.checks.has_role("BOT-Control")
 @bot.tree.command(name="redistrictarea", description="Redistrict the areas")
 @app_commands.describe(area_from="Which area is losing a square?")
 @app_commands.describe(area_to="Which area is gaining a square?")
+@app_commands.autocomplete(area_from=complete_redistrict_area, area_to=complete_redistrict_area)
 async def redistrictarea(interaction: Interaction, area_from: str, area_to: str):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
+    area_from = campaign.area_index.resolve(area_from) or area_from
+    area_to = campaign.area_index.resolve(area_to) or area_to
     area_choices = info.areas.copy()
     area_choices["DM"] = Area("DM", math.inf,math.inf,math.inf,math.inf,math.inf,math.inf,math.inf,math.inf,math.inf)
     if area_from not in area_choices or area_to not in area_choices:
@@ -776,11 +2864,37 @@ async def redistrictarea(interaction: Interaction, area_from: str, area_to: str)
     await interaction.response.send_message("Choose where resources are allocated from and to",view=view,ephemeral=True)
 
 exchange_rate = {"gold": 1, "food": 3, "steel": 3, "wood": 6, "stone": 6}
+
+def plan_trade(resources: dict, resource_to: str, amount: int, sources):
+    # every exchange unit swaps exchange_rate[from] of one resource for exchange_rate[to] of another, i.e. the
+    # same value whichever pair, so chaining trades never beats a direct one and any mix needs the same number
+    # of units; draw them from whichever sources can spare the most first. Returns [(resource, units), ...]
+    units = math.ceil(amount / exchange_rate[resource_to])
+    spare = sorted(((resources.get(r, 0) // exchange_rate[r], r) for r in sources if r != resource_to), reverse=True)
+    plan = []
+    for available, resource in spare:
+        if units <= 0:
+            break
+        if available > 0:
+            plan.append((resource, min(units, available)))
+            units -= plan[-1][1]
+    if units > 0:
+        raise TransactionError(f"Not enough to trade for {amount} {resource_to}, {units} more trades would be needed")
+    return plan
+
+async def complete_source(interaction: Interaction, current: str):
+    return choices((["any"] if "any".startswith(current.lower()) else []) + resource_index.complete(current, 24))
+
 @bot.tree.command(name="trade", description="Trade resources")
 @app_commands.describe(player_name="Name of player making trade.")
-@app_commands.describe(resource_from="Which resource is being sold?")
+@app_commands.describe(resource_from="Which resource is being sold? 'any' lets target mode pick.")
 @app_commands.describe(resource_to="Which resource is being bought?")
-async def trade(interaction: Interaction, player_name: str, resource_from: str, resource_to: str):
+@app_commands.describe(quantity="How many trades to make at once.")
+@app_commands.describe(target="Keep trading until the player holds this much of resource_to.")
+@app_commands.autocomplete(player_name=complete_player, resource_from=complete_source, resource_to=complete_resource)
+async def trade(interaction: Interaction, player_name: str, resource_from: str, resource_to: str, quantity: int = 1, target: int | None = None):
+    campaign = await campaigns.get(interaction)
+    info = campaign.info
     if player_name not in info.players:
         await interaction.response.send_message("❌ Invalid player name.", ephemeral=True)
         return
@@ -791,48 +2905,253 @@ async def trade(interaction: Interaction, player_name: str, resource_from: str,
             return
         if "DM" in resource_to:   # take resources away
             amount = int(resource_to[2:])
-            if player.resources[resource_from] < amount:
+            try:
+                async with Transaction(campaign, players=[player_name]) as tx:
+                    tx.change(player_name, resource_from, -amount)
+            except TransactionError:
                 await interaction.response.send_message(f"❌ Not enough of {resource_from}.", ephemeral=True)
             else:
-                player.resources[resource_from] -= amount
                 await interaction.response.send_message(f"🔁 **{player_name.title()}** lost {amount} {resource_from}.", ephemeral=True)
             return
         if "DM" in resource_from:   # give resources for free
             amount = int(resource_from[2:])
-            player.resources[resource_to] += amount
-            await interaction.response.send_message(f"🔁 **{player_name.title()}** was given {amount} {resource_to}.", ephemeral=True)
+            try:
+                async with Transaction(campaign, players=[player_name]) as tx:
+                    tx.change(player_name, resource_to, amount)
+            except TransactionError as e:
+                await interaction.response.send_message(f"❌ {e}.", ephemeral=True)
+            else:
+                await interaction.response.send_message(f"🔁 **{player_name.title()}** was given {amount} {resource_to}.", ephemeral=True)
             return
     else:
         resources_city = {"food", "wood", "stone", "steel", "gold"}
         resources_port = {"food", "wood", "stone"}
+        allowed = resources_city if player.city() >= 1 else resources_port
         if player.city() < 1 and player.port() < 1:
             await interaction.response.send_message("❌ This player does not own a city or port.", ephemeral=True)
             return
-        elif player.city()<1 and (resource_from not in resources_port or resource_to not in resources_port):
+        elif player.city()<1 and ((resource_from != "any" and resource_from not in resources_port) or resource_to not in resources_port):
             await interaction.response.send_message("❌ Cannot trade this resource at port (only food, wood and stone).", ephemeral=True)
             return
-        if resource_from not in resources_city or resource_to not in resources_city:
+        if (resource_from not in resources_city and resource_from != "any") or resource_to not in resources_city:
             await interaction.response.send_message("❌ Invalid resource name (food,wood,stone,steel,gold).", ephemeral=True)
             return
-        if player.resources[resource_from] < exchange_rate[resource_from]:
-            await interaction.response.send_message("❌ Not enough resources to make trade.", ephemeral=True)
+        if resource_from == "any" and target is None:
+            await interaction.response.send_message("❌ 'any' only works with a target amount.", ephemeral=True)
+            return
+        if quantity < 1:
+            await interaction.response.send_message("❌ Quantity must be at least 1.", ephemeral=True)
             return
-        player.resources[resource_to] += exchange_rate[resource_to]
-        player.resources[resource_from] -= exchange_rate[resource_from]
+        try:
+            async with Transaction(campaign, players=[player_name]) as tx:
+                if target is None:
+                    plan = [(resource_from, quantity)]
+                else:
+                    needed = target - player.resources.get(resource_to, 0)
+                    if needed <= 0:
+                        raise TransactionError(f"{player_name.title()} already has {player.resources.get(resource_to, 0)} {resource_to}")
+                    plan = plan_trade(player.resources, resource_to, needed, allowed if resource_from == "any" else [resource_from])
+                for resource, units in plan:
+                    tx.change(player_name, resource, -units*exchange_rate[resource])
+                    tx.change(player_name, resource_to, units*exchange_rate[resource_to])
+        except TransactionError as e:
+            await interaction.response.send_message(f"❌ {e if target is not None else 'Not enough resources to make trade.'}", ephemeral=True)
+            return
+        sold = ", ".join(f"{units*exchange_rate[resource]} **{resource}**" for resource, units in plan)
+        bought = sum(units for _, units in plan) * exchange_rate[resource_to]
+        await interaction.response.send_message(f"**{player_name.title()}** traded {sold} for {bought} **{resource_to}**", ephemeral=True)
+
+SYNC_GUILD = os.getenv("SYNC_GUILD", "0") == "1"
+TREE_HASH_FILE = os.path.join(BASE_DIR,".tree_hash")
+
+EXPORT_SPOOL = 8 * 1024 * 1024     # bytes of zip kept in memory before it spills to a temp file
+
+def export_rows(campaign):
+    # plain copies of the state, taken on the loop so the export is one consistent moment
+    info = campaign.info
+    players = [{"name": p.name, "username": p.username, "resources": dict(p.resources), "army": dict(p.army),
+                "totals": dict(p.totals), "ravens_left": p.ravens_left, "raven_limit": p.raven_limit,
+                "seals": sorted(p.seals), "areas": sorted(a.name for a in p.areas)} for p in info.players.values()]
+    areas = [{"name": a.name, "owner": a.owner.name if a.owner else None, "growth": dict(a.growth), "population": a.population,
+              "port": a.port, "fort": a.fort, "city": a.city, "neighbours": list(a.neighbours)} for a in info.areas.values()]
+    archived = os.path.getsize(campaign.archive.filename) if os.path.exists(campaign.archive.filename) else 0
+    return players, areas, archived
+
+def flatten(row: dict):
+    # nested dicts become prefixed columns and lists become ;-separated cells, for spreadsheets
+    flat = {}
+    for key, value in row.items():
+        if isinstance(value, dict):
+            flat.update({f"{key}_{k}" if key == "totals" else k: v for k, v in value.items()})
+        elif isinstance(value, list):
+            flat[key] = ";".join(value)
+        else:
+            flat[key] = value
+    return flat
+
+def write_table(bundle: zipfile.ZipFile, name: str, rows, file_format: str, columns=None):
+    # rows are streamed into the zip entry one at a time, nothing but the current row is held
+    with bundle.open(f"{name}.{file_format}", "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+        if file_format == "jsonl":
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+            return
+        writer = None
+        for row in rows:
+            row = flatten(row)
+            if writer is None:
+                writer = csv.DictWriter(f, columns or list(row))
+                writer.writeheader()
+            writer.writerow(row)
+
+def archived_ravens(filename: str, size: int):
+    # the archive as it stood when the export started, read line by line
+    with open(filename, "rb") as f:
+        while f.tell() < size:
+            yield json.loads(f.readline())
+
+def build_export(campaign, players, areas, archived: int, file_format: str):
+    # runs in a thread, the zip spills from memory to disk past EXPORT_SPOOL so a long history stays bounded
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL)
+    with zipfile.ZipFile(spool, "w", compression=zipfile.ZIP_DEFLATED) as bundle:
+        write_table(bundle, "players", players, file_format)
+        write_table(bundle, "areas", areas, file_format)
+        bundle.write(campaign.map_file, "resources.csv")
+        if archived and file_format == "jsonl":
+            with open(campaign.archive.filename, "rb") as f, bundle.open("ravens.jsonl", "w") as out:
+                while f.tell() < archived:      # already JSON lines, copied as it stood when the export started
+                    out.write(f.read(min(1 << 20, archived - f.tell())))
+        elif archived:
+            write_table(bundle, "ravens", archived_ravens(campaign.archive.filename, archived), file_format,
+                        columns=["sender", "recipient", "seal", "time", "text"])
+    size = spool.tell()
+    spool.seek(0)
+    return spool, size
+
+@app_commands.checks.has_role("BOT-Control")
+@bot.tree.command(name="export", description="Download the campaign's players, areas, map and ravens as a zip")
+@app_commands.describe(format="csv for spreadsheets, jsonl for scripts")
+@app_commands.choices(format=[app_commands.Choice(name="CSV", value="csv"), app_commands.Choice(name="JSON lines", value="jsonl")])
+async def export(interaction: Interaction, format: str = "csv"):
+    campaign = await campaigns.get(interaction)
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    spool, size = await asyncio.to_thread(build_export, campaign, *export_rows(campaign), format)
+    limit = getattr(interaction.guild, "filesize_limit", 10 * 1024 * 1024)
+    if size > limit:
+        spool.close()
+        await interaction.followup.send(f"❌ The export is {size / 2**20:.1f} MiB, over this server's {limit / 2**20:.0f} MiB upload limit.", ephemeral=True)
+        return
+    file = discord.File(spool, filename=f"campaign-{datetime.datetime.now(datetime.timezone.utc):%Y-%m-%d}-{format}.zip")
+    try:
+        await interaction.followup.send(f"📦 Campaign export ({size / 1024:.0f} KiB)", file=file, ephemeral=True)
+    finally:
+        file.close()     # gives the buffer its close() back, discord.File stubs it out while uploading
+        spool.close()
+
+def tree_hash():
+    # stable fingerprint of everything Discord is told about our commands
+    commands = sorted((command.to_dict(bot.tree) for command in bot.tree.get_commands()), key=lambda c: c["name"])
+    return hashlib.sha256(json.dumps(commands, sort_keys=True, default=str).encode()).hexdigest()
+
+async def sync_commands(force: bool = False):
+    # syncing is slow and heavily rate limited, so only do it when the tree actually changed
+    current = tree_hash()
+    try:
+        with open(TREE_HASH_FILE) as f:
+            stored = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        stored = {}
+    synced = []
+    for guild_id in (campaigns.guilds() if SYNC_GUILD else [None]):
+        key = f"guild:{guild_id}" if guild_id else "global"
+        if not force and stored.get(key) == current:
+            print(f"🔁 Command tree unchanged, skipping sync ({key}).")
+            continue
+        try:
+            if guild_id:      # guild commands show up immediately, global ones can take a while
+                guild = discord.Object(id=guild_id)
+                bot.tree.copy_global_to(guild=guild)
+                synced = await bot.tree.sync(guild=guild)
+            else:
+                synced = await bot.tree.sync()
+        except discord.HTTPException as e:
+            print(f"⚠️ Failed to sync commands ({key}): {e}")     # e.g. a guild under campaigns/ the bot has left
+            continue
+        stored[key] = current
+        write_atomic(TREE_HASH_FILE, json.dumps(stored).encode())
+        print(f"🔁 Synced {len(synced)} commands ({key}).")
+    if SYNC_GUILD and (force or stored.get("global") != "cleared"):
+        # a global registration left over from before would list every command twice in those guilds;
+        # it's emptied on Discord's side only, the local tree keeps them to copy into guilds
+        try:
+            await bot.http.bulk_upsert_global_commands(bot.application_id, [])
+        except discord.HTTPException as e:
+            print(f"⚠️ Failed to clear global commands: {e}")
+        else:
+            stored["global"] = "cleared"
+            write_atomic(TREE_HASH_FILE, json.dumps(stored).encode())
+            print("🔁 Cleared global commands, guild commands replace them.")
+    return synced
 
-        store_info(info=info)
-        await interaction.response.send_message(f"**{player_name.title()}** traded {exchange_rate[resource_from]} **{resource_from}** for {exchange_rate[resource_to]} **{resource_to}**", ephemeral=True)
+@app_commands.checks.has_role("BOT-Control")
+@bot.tree.command(name="resync", description="Force the slash commands to sync with Discord")
+async def resync(interaction: Interaction):
+    await interaction.response.defer(ephemeral=True)
+    synced = await sync_commands(force=True)
+    await interaction.followup.send(f"🔁 Synced {len(synced)} commands.", ephemeral=True)
+
+METRICS_PORT = os.getenv("METRICS_PORT")
+
+async def serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # bare-bones HTTP, every request gets the Prometheus text exposition
+    try:
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        body = metrics.prometheus().encode()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+# commands whose main reply is private, every other command answers publicly
+PRIVATE_COMMANDS = {"reload_players", "dashboard", "check_aggregates", "battle_odds", "cancel", "contention", "metrics",
+                    "raven", "raven_refund", "raven_search", "armybuy", "armysell", "armyrefund", "armygive",
+                    "redistrictarea", "trade", "export", "resync"}
+
+def instrument_commands():
+    for command in bot.tree.walk_commands():
+        if isinstance(command, app_commands.Command):
+            command._callback = instrumented(command._callback, command.name, ephemeral=command.name in PRIVATE_COMMANDS)
+
+@bot.event
+async def setup_hook():
+    # docker/systemctl stop send SIGTERM, which would otherwise kill the process before the final save below
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(bot.close()))
+    except NotImplementedError:
+        pass    # no loop signal handlers on Windows
+    for guild_id in campaigns.guilds():
+        directory = campaigns.directory(guild_id)
+        journal = os.path.join(directory, "ravens.jsonl")
+        # undelivered ravens and scheduled weeks shouldn't wait for someone to use the bot
+        if (os.path.exists(journal) and os.path.getsize(journal)) or os.path.exists(os.path.join(directory, "schedule.json")):
+            await campaigns.load(guild_id)
+    if METRICS_PORT:
+        await asyncio.start_server(serve_metrics, "127.0.0.1", int(METRICS_PORT))
+    await sync_commands()   # runs once per process, not on every gateway reconnect
 
-GUILD_ID = 1423782088494157896
 @bot.event
 async def on_ready():
     print(f"Logged in as {bot.user}")
-
-    synced = await bot.tree.sync()  # global sync
-    print(f"🔁 Synced {len(synced)} commands.")
     print("Commands in tree:", bot.tree.get_commands())
 
+instrument_commands()   # after every command is defined
+
 # -----------------------------
 # RUN THE BOT
 # -----------------------------
-bot.run(os.getenv("DISCORD_API_TOKEN"))
+if __name__ == "__main__":
+    bot.run(os.getenv("DISCORD_API_TOKEN"))
+    campaigns.close()    # anything still pending when the bot shut down
+    offload.close()